@@ -0,0 +1,9 @@
+"""
+Stand-in for BPyMesh of Blender 2.49, see Blender.py
+"""
+
+
+def getMeshFromObject(ob, container_mesh=None, apply_modifiers=True, vgroups=True, scn=None):
+    """ Copies the mesh of ob into container_mesh, there are no modifiers """
+    container_mesh.getFromObject(ob)
+    return container_mesh
@@ -0,0 +1,382 @@
+"""
+Stand-in for the parts of the Blender 2.49 API used by the XML3D exporter.
+
+Only attributes and functions the exporter touches are implemented, with
+plain Python objects, so that the exporter can run without Blender.
+"""
+
+import os as _os
+import time as _time
+
+
+class _Namespace(object):
+    def __init__(self, **entries):
+        self.__dict__.update(entries)
+
+
+# --------------------------------------------------------------------------
+# Mathutils
+# --------------------------------------------------------------------------
+
+class Vector(object):
+    __slots__ = ('_v',)
+
+    def __init__(self, *values):
+        if len(values) == 1:
+            values = values[0]
+        self._v = tuple([float(v) for v in values])
+
+    def __iter__(self):
+        return iter(self._v)
+
+    def __len__(self):
+        return len(self._v)
+
+    def __getitem__(self, i):
+        return self._v[i]
+
+    def __eq__(self, other):
+        return other is not None and self._v == tuple(other)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(self._v)
+
+    x = property(lambda self: self._v[0])
+    y = property(lambda self: self._v[1])
+    z = property(lambda self: self._v[2])
+
+
+class Quaternion(object):
+    def __init__(self, axis, angle):
+        self.axis = Vector(axis)
+        self.angle = angle  # degrees, like Blender 2.49
+
+
+class Matrix(object):
+    """ A rotation matrix, only convertible to a quaternion """
+
+    def __init__(self, axis=(0.0, 0.0, 1.0), angle=0.0):
+        self._quat = Quaternion(axis, angle)
+
+    def rotationPart(self):
+        return self
+
+    def toQuat(self):
+        return self._quat
+
+
+Mathutils = _Namespace(Vector=Vector, Quaternion=Quaternion, Matrix=Matrix)
+
+
+# --------------------------------------------------------------------------
+# Meshes
+# --------------------------------------------------------------------------
+
+class MVert(object):
+    __slots__ = ('index', 'co', 'no')
+
+    def __init__(self, index, co, no):
+        self.index = index
+        self.co = Vector(co)
+        self.no = Vector(no)
+
+
+class MFace(object):
+    __slots__ = ('v', 'no', 'smooth', 'mat', 'uv')
+
+    def __init__(self, verts, no, smooth=False, mat=0, uv=None):
+        self.v = verts
+        self.no = Vector(no)
+        self.smooth = smooth
+        self.mat = mat
+        if uv is not None:
+            uv = [Vector(u) for u in uv]
+        self.uv = uv
+
+    def __iter__(self):
+        return iter(self.v)
+
+    def __len__(self):
+        return len(self.v)
+
+
+class MeshData(object):
+    """ Blender.Mesh.Mesh """
+
+    def __init__(self, name, verts=(), faces=(), materials=(), faceUV=False):
+        self.name = name
+        self.verts = list(verts)
+        self.faces = list(faces)
+        self.materials = list(materials)
+        self.faceUV = faceUV
+        self.users = 0
+        self.sel = False
+
+    def getFromObject(self, obj):
+        source = obj.getData(mesh=True)
+        self.verts = source.verts
+        self.faces = list(source.faces)
+        self.materials = list(source.materials)
+        self.faceUV = source.faceUV
+
+    def quadToTriangle(self, method=0):
+        """ Splits quads along their shorter diagonal """
+        faces = []
+        for face in self.faces:
+            if len(face) != 4:
+                faces.append(face)
+                continue
+            co = [v.co for v in face.v]
+            d02 = sum([(a - b) ** 2 for a, b in zip(co[0], co[2])])
+            d13 = sum([(a - b) ** 2 for a, b in zip(co[1], co[3])])
+            if d02 <= d13:
+                triangles = ((0, 1, 2), (0, 2, 3))
+            else:
+                triangles = ((0, 1, 3), (1, 2, 3))
+            for t in triangles:
+                uv = None
+                if face.uv:
+                    uv = [face.uv[i] for i in t]
+                faces.append(MFace([face.v[i] for i in t], face.no, face.smooth, face.mat, uv))
+        self.faces = faces
+
+
+class _MeshModule(object):
+    SelectModes = {'VERTEX': 1, 'EDGE': 2, 'FACE': 4}
+
+    def __init__(self):
+        self._mode = 1
+        self.meshes = {}
+
+    def Mode(self, mode=None):
+        old = self._mode
+        if mode is not None:
+            self._mode = mode
+        return old
+
+    def New(self, name):
+        mesh = MeshData(name)
+        self.meshes[name] = mesh
+        return mesh
+
+    def Get(self, name):
+        return self.meshes[name]
+
+
+Mesh = _MeshModule()
+NMesh = _Namespace(GetNames=lambda: list(Mesh.meshes.keys()))
+
+
+# --------------------------------------------------------------------------
+# Materials, lamps, world
+# --------------------------------------------------------------------------
+
+class MaterialData(object):
+    def __init__(self, name, rgbCol=(0.8, 0.8, 0.8)):
+        self.name = name
+        self.users = 0
+        self.rgbCol = list(rgbCol)
+        self.specCol = [1.0, 1.0, 1.0]
+        self.amb = 0.5
+        self.spec = 0.5
+        self.hard = 50
+        self.alpha = 1.0
+        self.emit = 0.0
+        self.mode = 0
+        self.rayMirr = 0.0
+        self.textures = [None] * 10
+        self.rbFriction = 0.5
+        self.rbRestitution = 0.0
+
+    def getEmit(self):
+        return self.emit
+
+
+Material = _Namespace(Modes=_Namespace(RAYMIRROR=1 << 18))
+
+
+class LampData(object):
+    def __init__(self, name):
+        self.name = name
+        self.users = 0
+        self.type = 0
+        self.mode = 0
+        self.falloffType = 1
+        self.dist = 20.0
+        self.r = self.g = self.b = 1.0
+
+
+Lamp = _Namespace(Types=_Namespace(Lamp=0, Sun=1, Spot=2, Hemi=3, Area=4),
+                  Modes=_Namespace(RayShadow=1 << 13, Shadows=1),
+                  Falloffs=_Namespace(CONSTANT=0, INVLINEAR=1, INVSQUARE=2))
+
+Texture = _Namespace(TexCo=_Namespace(UV=16), MapTo=_Namespace(COL=1), Types=_Namespace(IMAGE=8))
+
+
+class ImageData(object):
+    """ Blender.Image.Image, filename may start with // for the directory of the .blend file """
+
+    def __init__(self, name, filename):
+        self.name = name
+        self.filename = filename
+        self.users = 0
+
+
+class TextureData(object):
+    """ Blender.Texture.Texture """
+
+    def __init__(self, name, image=None):
+        self.name = name
+        self.type = Texture.Types.IMAGE
+        self.image = image
+        self.users = 0
+
+
+class MTex(object):
+    """ An entry of MaterialData.textures, a texture with its mapping """
+
+    def __init__(self, tex, texco=Texture.TexCo.UV, mapto=Texture.MapTo.COL):
+        self.tex = tex
+        self.texco = texco
+        self.mapto = mapto
+        self.colfac = 1.0
+
+
+class CameraData(object):
+    def __init__(self, name):
+        self.name = name
+        self.users = 0
+
+
+class WorldData(object):
+    def __init__(self):
+        self.amb = (0.1, 0.1, 0.1)
+        self.gravity = 9.81
+
+    def getHor(self):
+        return (0.2, 0.3, 0.4)
+
+
+World = _Namespace(GetCurrent=lambda: _state['scene'] and _state['scene'].world)
+
+
+# --------------------------------------------------------------------------
+# Objects and scenes
+# --------------------------------------------------------------------------
+
+class ObjectData(object):
+    """ Blender.Object.Object """
+
+    def __init__(self, name, type, data, loc=(0.0, 0.0, 0.0), size=(1.0, 1.0, 1.0)):
+        self.name = name
+        self.type = type
+        self.data = data
+        self.restrictRender = False
+        self.Layers = 1
+        self.users = 1
+        self.ipo = None
+        self.parent = None
+        self.LocX, self.LocY, self.LocZ = loc
+        self.SizeX, self.SizeY, self.SizeZ = size
+        self.matrix = self.mat = Matrix()
+        data.users += 1
+
+    def getType(self):
+        return self.type
+
+    def getData(self, name_only=False, mesh=False):
+        if name_only:
+            return self.data.name
+        return self.data
+
+
+class SceneObjects(list):
+    """ Scene.objects, a list with an active camera """
+    camera = None
+
+    def new(self, data):
+        obj = ObjectData(data.name, 'Mesh', data)
+        self.append(obj)
+        return obj
+
+    def unlink(self, obj):
+        self.remove(obj)
+        obj.data.users -= 1
+
+
+class RenderData(object):
+    sizeX = 800
+    sizeY = 600
+    sFrame = 1
+    eFrame = 250
+    fps = 25
+    fpsBase = 1.0
+
+
+class SceneData(object):
+    def __init__(self, name='Scene'):
+        self.name = name
+        self.objects = SceneObjects()
+        self.world = WorldData()
+        self.Layers = 1
+
+    def getRenderingContext(self):
+        return RenderData()
+
+
+class IpoData(object):
+    """ An object Ipo, apply(obj, frame) sets the animated attributes of obj """
+
+    def __init__(self, apply):
+        self.apply = apply
+
+
+_state = {'filename': 'benchmark.blend', 'scene': None, 'curframe': 1}
+
+
+def setCurrentScene(scene, filename='benchmark.blend'):
+    _state['scene'] = scene
+    _state['filename'] = filename
+
+
+Scene = _Namespace(GetCurrent=lambda: _state['scene'])
+
+
+def Get(key):
+    return _state[key]
+
+
+def Set(key, value):
+    _state[key] = value
+    if key == 'curframe' and _state['scene']:
+        for obj in _state['scene'].objects:
+            if obj.ipo:
+                obj.ipo.apply(obj, value)
+
+
+def Quit():
+    pass
+
+
+def _expandpath(path):
+    # Paths starting with // are relative to the .blend file
+    if path.startswith('//'):
+        path = _os.path.join(_os.path.dirname(_os.path.abspath(_state['filename'])), path[2:])
+    return path
+
+
+sys = _Namespace(time=_time.time, basename=_os.path.basename, expandpath=_expandpath)
+
+
+class _Window(object):
+    def WaitCursor(self, on):
+        pass
+
+    def FileSelector(self, callback, title, filename):
+        pass
+
+
+Window = _Window()
@@ -0,0 +1,15 @@
+"""
+Stand-in for bpy of Blender 2.49, see Blender.py
+"""
+
+
+class _Data(object):
+    def __init__(self):
+        self.objects = []
+        self.meshes = []
+        self.lamps = []
+        self.materials = []
+        self.cameras = []
+
+
+data = _Data()
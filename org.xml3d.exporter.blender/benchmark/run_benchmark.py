@@ -0,0 +1,138 @@
+"""
+Headless benchmark of the XML3D exporter.
+
+Runs xml3d_exporter.write() end to end on synthetic scenes with a fake
+Blender API and reports throughput and peak memory. Every scene size is
+exported in its own process, so peak memory is not inherited from
+earlier runs.
+
+    python run_benchmark.py --faces 1000,10000,100000,1000000 --json results.json
+
+Additional exporter options can be set with --option name=value, for
+example --option binaryBuffers=True.
+"""
+
+import json
+import optparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "fakeblender"))
+sys.path.insert(0, os.path.join(HERE, "..", "src"))
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def peakMemory():
+    if not resource:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != 'darwin':
+        peak *= 1024
+    return peak
+
+
+def runSingle(faces, meshes, duplicates, quads, options, directory):
+    """ Exports one scene in this process and returns its measurements """
+    import scenes
+    scene = scenes.makeScene(faces, meshes, duplicates, quads)
+    faceCount = scenes.countFaces(scene)
+
+    # Importing the exporter runs its (fake) GUI entry point
+    import xml3d_exporter
+
+    filename = os.path.join(directory, "benchmark.xhtml")
+    exporter = xml3d_exporter.xml3d_exporter(filename, False)
+    for name, value in options:
+        setattr(exporter, name, value)
+
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        start = time.time()
+        exporter.write(scene)
+        seconds = time.time() - start
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+    outputBytes = 0
+    for name in os.listdir(directory):
+        if not name.endswith("-metrics.json"):
+            outputBytes += os.path.getsize(os.path.join(directory, name))
+    return {
+        "faces": faceCount,
+        "seconds": seconds,
+        "facesPerSecond": faceCount / seconds,
+        "outputBytes": outputBytes,
+        "megabytesPerSecond": outputBytes / seconds / (1024.0 * 1024.0),
+        "peakMemory": peakMemory(),
+    }
+
+
+def parseOptions(values):
+    options = []
+    for value in values:
+        name, text = value.split("=", 1)
+        options.append((name, eval(text)))
+    return options
+
+
+def main():
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option("--faces", default="1000,10000,100000",
+                      help="comma separated face counts [%default]")
+    parser.add_option("--meshes", type="int", default=16, help="meshes per scene [%default]")
+    parser.add_option("--duplicates", type="int", default=0,
+                      help="additional objects with the geometry of another mesh [%default]")
+    parser.add_option("--triangles", action="store_true", help="generate triangles instead of quads")
+    parser.add_option("--option", action="append", default=[], metavar="NAME=VALUE",
+                      help="set an exporter attribute, VALUE is a Python expression")
+    parser.add_option("--json", metavar="FILE", help="also write the results to FILE")
+    parser.add_option("--single", action="store_true", help=optparse.SUPPRESS_HELP)
+    opts, args = parser.parse_args()
+
+    if opts.single:
+        directory = tempfile.mkdtemp(prefix="xml3d-benchmark-")
+        try:
+            result = runSingle(int(opts.faces), opts.meshes, opts.duplicates, not opts.triangles,
+                               parseOptions(opts.option), directory)
+        finally:
+            shutil.rmtree(directory)
+        print(json.dumps(result))
+        return
+
+    results = []
+    print("%12s %10s %14s %10s %12s" % ("faces", "seconds", "faces/s", "MB/s", "peak MB"))
+    for faces in opts.faces.split(","):
+        command = [sys.executable, os.path.abspath(__file__), "--single", "--faces", faces,
+                   "--meshes", str(opts.meshes), "--duplicates", str(opts.duplicates)]
+        if opts.triangles:
+            command.append("--triangles")
+        for option in opts.option:
+            command.extend(["--option", option])
+        output = subprocess.Popen(command, stdout=subprocess.PIPE).communicate()[0]
+        result = json.loads(output.decode("ascii").strip().splitlines()[-1])
+        results.append(result)
+        peak = result["peakMemory"] and result["peakMemory"] / (1024.0 * 1024.0) or 0.0
+        print("%12i %10.2f %14.0f %10.2f %12.1f" % (result["faces"], result["seconds"],
+              result["facesPerSecond"], result["megabytesPerSecond"], peak))
+
+    if opts.json:
+        f = open(opts.json, 'w')
+        try:
+            json.dump({ "python": sys.version.split()[0], "results": results }, f, indent=1)
+        finally:
+            f.close()
+
+
+if __name__ == "__main__":
+    main()
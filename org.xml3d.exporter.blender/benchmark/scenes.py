@@ -0,0 +1,95 @@
+"""
+Synthetic scenes for benchmarking the XML3D exporter with the fake Blender API.
+"""
+
+import math
+
+import Blender, bpy #@UnresolvedImport
+from Blender import MVert, MFace, MeshData, MaterialData, LampData, CameraData, ObjectData, SceneData #@UnresolvedImport
+
+
+def makeGrid(name, rows, columns, materials=(), smooth=False, uv=True, quads=True, seed=0):
+    """ A wavy rows x columns grid of quads, or twice as many triangles.
+    The waves are shifted by seed, thus grids with different seeds differ """
+    verts = []
+    for j in range(rows + 1):
+        for i in range(columns + 1):
+            x, y = i / float(columns), j / float(rows)
+            z = 0.05 * math.sin(x * 12.0 + seed) * math.cos(y * 9.0 + 0.5 * seed)
+            verts.append(MVert(len(verts), (x, y, z), (0.0, 0.0, 1.0)))
+
+    faces = []
+    materialCount = max(len(materials), 1)
+    for j in range(rows):
+        for i in range(columns):
+            a = j * (columns + 1) + i
+            quad = [verts[a], verts[a + 1], verts[a + columns + 2], verts[a + columns + 1]]
+            quadUV = None
+            if uv:
+                u0, v0 = i / float(columns), j / float(rows)
+                u1, v1 = (i + 1) / float(columns), (j + 1) / float(rows)
+                quadUV = [(u0, v0), (u1, v0), (u1, v1), (u0, v1)]
+            mat = (i * materialCount) // columns
+            normal = (0.0, 0.0, 1.0)
+            if quads:
+                faces.append(MFace(quad, normal, smooth, mat, quadUV))
+            else:
+                for t in ((0, 1, 2), (0, 2, 3)):
+                    faces.append(MFace([quad[k] for k in t], normal, smooth, mat,
+                                       quadUV and [quadUV[k] for k in t]))
+    return MeshData(name, verts, faces, materials, uv)
+
+
+def makeScene(faceCount, meshCount=16, duplicates=0, quads=True):
+    """ A scene with about faceCount faces spread over meshCount grid meshes.
+
+    Every other mesh is smooth shaded, every third one has two materials.
+    Each mesh has its own geometry, except for the duplicates objects,
+    which reuse copies of the first mesh's geometry.
+    """
+    scene = SceneData()
+    materials = [MaterialData("red", (0.8, 0.1, 0.1)), MaterialData("green", (0.1, 0.8, 0.1))]
+    lamp = LampData("Lamp")
+    camera = CameraData("Camera")
+
+    facesPerMesh = max(faceCount // meshCount, 1)
+    if not quads:
+        facesPerMesh = max(facesPerMesh // 2, 1)
+    side = max(int(math.sqrt(facesPerMesh)), 1)
+
+    objects, meshes = [], []
+    for k in range(meshCount):
+        meshMaterials = materials[:1 + (k % 3 == 2)]
+        mesh = makeGrid("Mesh.%03i" % k, side, max(facesPerMesh // side, 1), meshMaterials,
+                        smooth=bool(k % 2), quads=quads, seed=k)
+        meshes.append(mesh)
+        objects.append(ObjectData("Object.%03i" % k, 'Mesh', mesh, loc=(k % 8, k // 8, 0.0)))
+    for k in range(duplicates):
+        mesh = makeGrid("Copy.%03i" % k, side, max(facesPerMesh // side, 1), materials[:1], quads=quads)
+        meshes.append(mesh)
+        objects.append(ObjectData("Copy.%03i" % k, 'Mesh', mesh, loc=(k, -2.0, 0.0)))
+
+    objects.append(ObjectData("Lamp", 'Lamp', lamp, loc=(4.0, 4.0, 5.0)))
+    cameraObject = ObjectData("Camera", 'Camera', camera, loc=(4.0, -6.0, 4.0))
+    objects.append(cameraObject)
+
+    scene.objects.extend(objects)
+    scene.objects.camera = cameraObject
+    for material in materials:
+        material.users = 1
+
+    bpy.data.objects = list(objects)
+    bpy.data.meshes = meshes
+    bpy.data.lamps = [lamp]
+    bpy.data.cameras = [camera]
+    bpy.data.materials = materials
+    Blender.setCurrentScene(scene)
+    return scene
+
+
+def countFaces(scene):
+    count = 0
+    for obj in scene.objects:
+        if obj.getType() == 'Mesh':
+            count += len(obj.getData(mesh=True).faces)
+    return count
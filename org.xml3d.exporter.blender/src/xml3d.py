@@ -1,11 +1,31 @@
 try:
-	from xml.dom.minidom import Document, Element, Childless, Text, _write_data
+	from xml.dom.minidom import Node, Document, Element, Text, _write_data
+	from xml.dom import InvalidStateErr
 except:
-	print "\nError! Could not find XML modules!"
+	print("\nError! Could not find XML modules!")
 
 class XML3DDocument( Document ):
 	""" An XML3D Document ( xml3d.org ) """
 
+	def createElement( self, tagName ):
+		e = _XML3DElement( tagName )
+		e.ownerDocument = self
+		return e
+
+	def createElementNS( self, namespaceURI, qualifiedName ):
+		e = _XML3DElement( qualifiedName )
+		e.namespaceURI = namespaceURI
+		e.ownerDocument = self
+		return e
+
+	def _prepareAppend( self, parent, node ):
+		""" Called before node is appended to parent. Does nothing for in-memory documents """
+		pass
+
+	def _isOpen( self, node ):
+		""" Whether the start tag of node has been written. Never for in-memory documents """
+		return False
+
 	def createXml3dElement( self, id_ = None, height_ = None, width_ = None, activeView_ = None ):
 		#print 'Creating element  xml3d'
 		e = _Xml3dElement( id_, height_, width_, activeView_ )
@@ -132,6 +152,104 @@ class XML3DDocument( Document ):
 		e.ownerDocument = self
 		return e
 		
+class XML3DStreamDocument( XML3DDocument ):
+	""" An XML3D Document that writes every completed subtree straight to a stream
+
+	Elements stay in memory only until a following sibling is appended to their
+	parent or the document is closed. The start tag of an element is written
+	as soon as its first child element is appended, thus all attributes have
+	to be set before that: setAttribute raises InvalidStateErr afterwards.
+	Nodes must not be modified once they were written.
+	"""
+
+	def __init__( self, writer, indent = "", addindent = "", newl = "", encoding = None ):
+		XML3DDocument.__init__( self )
+		self._writer = writer
+		self._indent = indent
+		self._addindent = addindent
+		self._newl = newl
+		# Elements whose start tag has been written, beginning with the document
+		self._open = [ self ]
+		if encoding is None:
+			writer.write( '<?xml version="1.0" ?>' + newl )
+		else:
+			writer.write( '<?xml version="1.0" encoding="%s"?>%s' % ( encoding, newl ) )
+
+	def appendChild( self, node ):
+		self._prepareAppend( self, node )
+		return XML3DDocument.appendChild( self, node )
+
+	def close( self ):
+		""" Writes all pending nodes and end tags. The writer is not closed """
+		self._closeTo( self )
+		self._flushChildren( self )
+
+	def _prepareAppend( self, parent, node ):
+		# Text nodes do not open their parent, so that value elements
+		# are written inline by Element.writexml
+		if node.nodeType == Node.TEXT_NODE and not self._isOpen( parent ):
+			return
+		if not self._attach( parent ):
+			return
+		self._closeTo( parent )
+		self._flushChildren( parent )
+
+	def _isOpen( self, node ):
+		for e in self._open:
+			if e is node:
+				return True
+		return False
+
+	def _attach( self, node ):
+		""" Writes the start tag of node if it is the last child of an open element """
+		if self._isOpen( node ):
+			return True
+		parent = node.parentNode
+		if parent is None or not parent.childNodes or parent.childNodes[-1] is not node:
+			return False
+		if not self._attach( parent ):
+			return False
+		self._closeTo( parent )
+		self._flushChildren( parent, node )
+		self._writeStartTag( node )
+		# From now on the end tag is written by _closeTo
+		parent.childNodes[:] = []
+		self._open.append( node )
+		return True
+
+	def _closeTo( self, node ):
+		while self._open[-1] is not node:
+			e = self._open[-1]
+			self._flushChildren( e )
+			self._open.pop()
+			self._writer.write( "%s</%s>%s" % ( self._indent + self._addindent * ( len( self._open ) - 1 ), e.tagName, self._newl ) )
+
+	def _flushChildren( self, parent, keep = None ):
+		""" Writes and releases all children of the open element parent except keep """
+		indent = self._indent + self._addindent * ( len( self._open ) - 1 )
+		for child in parent.childNodes:
+			if child is keep:
+				continue
+			child.writexml( self._writer, indent, self._addindent, self._newl )
+			child.unlink()
+		if keep is None:
+			parent.childNodes[:] = []
+		else:
+			parent.childNodes[:] = [ keep ]
+			keep.previousSibling = None
+
+	def _writeStartTag( self, node ):
+		writer = self._writer
+		writer.write( self._indent + self._addindent * ( len( self._open ) - 1 ) + "<" + node.tagName )
+		attrs = node._get_attributes()
+		a_names = list( attrs.keys() )
+		a_names.sort()
+		for a_name in a_names:
+			writer.write( " %s=\"" % a_name )
+			_write_data( writer, attrs[a_name].value )
+			writer.write( "\"" )
+		writer.write( ">" + self._newl )
+
 class _XML3DElement( Element ):
 	""" A XML3DBaseType Element """
 
@@ -139,10 +257,23 @@ class _XML3DElement( Element ):
 
 	def __init__( self, name, id_ = None, class_ = None, style_ = None):
 		Element.__init__( self, name )
+		# Assigned by the document, Python 3 minidom leaves it unset
+		self.ownerDocument = None
 		self._id = id_
 		if not (self._id == None):
 			self.setAttribute( "id", self._id )
 
+	def appendChild( self, node ):
+		self.ownerDocument._prepareAppend( self, node )
+		return Element.appendChild( self, node )
+
+	def setAttribute( self, attname, value ):
+		# A streaming document has written the start tag already, the
+		# attribute would be lost
+		if self.ownerDocument is not None and self.ownerDocument._isOpen( self ):
+			raise InvalidStateErr( "Attribute %s set on <%s> after its start tag was written" % ( attname, self.tagName ) )
+		Element.setAttribute( self, attname, value )
+
 
 class _Xml3dElement( _XML3DElement ):
 	""" A xml3d Element """
@@ -505,6 +636,12 @@ class _FloatElement( _XML3DElement ):
 	
 	def setValue( self, value ):
 		self.appendChild(self.ownerDocument.createTextNode(value))
+		
+	def setBuffer( self, src, byteOffset, byteLength ):
+		""" References the values in a binary buffer instead of inlining them """
+		self.setAttribute( "src", src )
+		self.setAttribute( "byteOffset", str( byteOffset ) )
+		self.setAttribute( "byteLength", str( byteLength ) )
 
 class _Float2Element( _XML3DElement ):
 	""" A float2 Element """
@@ -524,6 +661,12 @@ class _Float2Element( _XML3DElement ):
 	
 	def setValue( self, value ):
 		self.appendChild(self.ownerDocument.createTextNode(value))
+		
+	def setBuffer( self, src, byteOffset, byteLength ):
+		""" References the values in a binary buffer instead of inlining them """
+		self.setAttribute( "src", src )
+		self.setAttribute( "byteOffset", str( byteOffset ) )
+		self.setAttribute( "byteLength", str( byteLength ) )
 
 class _Float3Element( _XML3DElement ):
 	""" A float3 Element """
@@ -543,6 +686,12 @@ class _Float3Element( _XML3DElement ):
 	
 	def setValue( self, value ):
 		self.appendChild(self.ownerDocument.createTextNode(value))
+		
+	def setBuffer( self, src, byteOffset, byteLength ):
+		""" References the values in a binary buffer instead of inlining them """
+		self.setAttribute( "src", src )
+		self.setAttribute( "byteOffset", str( byteOffset ) )
+		self.setAttribute( "byteLength", str( byteLength ) )
 
 class _Float4Element( _XML3DElement ):
 	""" A float4 Element """
@@ -562,6 +711,12 @@ class _Float4Element( _XML3DElement ):
 	
 	def setValue( self, value ):
 		self.appendChild(self.ownerDocument.createTextNode(value))
+		
+	def setBuffer( self, src, byteOffset, byteLength ):
+		""" References the values in a binary buffer instead of inlining them """
+		self.setAttribute( "src", src )
+		self.setAttribute( "byteOffset", str( byteOffset ) )
+		self.setAttribute( "byteLength", str( byteLength ) )
 
 class _Float4x4Element( _XML3DElement ):
 	""" A float4x4 Element """
@@ -581,6 +736,12 @@ class _Float4x4Element( _XML3DElement ):
 	
 	def setValue( self, value ):
 		self.appendChild(self.ownerDocument.createTextNode(value))
+		
+	def setBuffer( self, src, byteOffset, byteLength ):
+		""" References the values in a binary buffer instead of inlining them """
+		self.setAttribute( "src", src )
+		self.setAttribute( "byteOffset", str( byteOffset ) )
+		self.setAttribute( "byteLength", str( byteLength ) )
 
 class _IntElement( _XML3DElement ):
 	""" A int Element """
@@ -600,6 +761,12 @@ class _IntElement( _XML3DElement ):
 	
 	def setValue( self, value ):
 		self.appendChild(self.ownerDocument.createTextNode(value))
+		
+	def setBuffer( self, src, byteOffset, byteLength ):
+		""" References the values in a binary buffer instead of inlining them """
+		self.setAttribute( "src", src )
+		self.setAttribute( "byteOffset", str( byteOffset ) )
+		self.setAttribute( "byteLength", str( byteLength ) )
 
 class _BoolElement( _XML3DElement ):
 	""" A bool Element """
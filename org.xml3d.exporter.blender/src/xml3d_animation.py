@@ -0,0 +1,149 @@
+# --------------------------------------------------------------------------
+# XML3D exporter: keyframe animation
+# --------------------------------------------------------------------------
+# ***** BEGIN GPL LICENSE BLOCK *****
+#
+# Copyright (C) 2010: DFKI GmbH, kristian.sons@dfki.de
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+#
+# ***** END GPL LICENCE BLOCK *****
+# --------------------------------------------------------------------------
+#
+# Works on sampled transform values only, thus nothing in here depends on
+# the Blender API.
+
+import math
+
+
+class AnimationTrack:
+    """ Keys of one attribute of a transform """
+
+    def __init__(self, name, size, times, values):
+        self.name = name          # translation, rotation or scale
+        self.size = size          # values per key, rotations are quaternions x y z w
+        self.times = times        # seconds per key
+        self.values = values      # flat, size values per key
+        self.sampleCount = len(times)
+
+
+def axisAngleToQuaternion(axis, angle):
+    """ The quaternion (x, y, z, w) of a rotation by angle radians around axis """
+    length = (axis[0] ** 2 + axis[1] ** 2 + axis[2] ** 2) ** 0.5
+    if length == 0.0:
+        return (0.0, 0.0, 0.0, 1.0)
+    s = math.sin(angle * 0.5) / length
+    return (axis[0] * s, axis[1] * s, axis[2] * s, math.cos(angle * 0.5))
+
+
+def alignQuaternions(quaternions):
+    """ Flips the sign of quaternions where needed, thus consecutive ones
+    are interpolated along the shorter arc """
+    result = []
+    previous = None
+    for q in quaternions:
+        if previous is not None and sum([a * b for a, b in zip(q, previous)]) < 0.0:
+            q = tuple([-a for a in q])
+        result.append(q)
+        previous = q
+    return result
+
+
+def lerp(a, b, t):
+    return [x + (y - x) * t for x, y in zip(a, b)]
+
+
+def slerp(a, b, t):
+    """ Interpolates along the shorter arc like clients play keys back,
+    whatever the signs of a and b """
+    cos = sum([x * y for x, y in zip(a, b)])
+    if cos < 0.0:
+        b, cos = [-y for y in b], -cos
+    if cos > 0.9995:
+        # Nearly parallel, normalized linear interpolation is exact enough
+        q = lerp(a, b, t)
+        length = sum([x * x for x in q]) ** 0.5
+        return [x / length for x in q]
+    angle = math.acos(max(min(cos, 1.0), -1.0))
+    sin = math.sin(angle)
+    wa, wb = math.sin((1.0 - t) * angle) / sin, math.sin(t * angle) / sin
+    return [x * wa + y * wb for x, y in zip(a, b)]
+
+
+def distance(a, b):
+    return sum([(x - y) ** 2 for x, y in zip(a, b)]) ** 0.5
+
+
+def rotationAngle(a, b):
+    """ Angle in radians of the rotation between two unit quaternions """
+    cos = abs(sum([x * y for x, y in zip(a, b)]))
+    return 2.0 * math.acos(min(cos, 1.0))
+
+
+def reduceKeys(times, samples, interpolate, error, tolerance, connected=None):
+    """ Indices of the samples to keep as keys, such that interpolating
+    between them differs from no sample by more than tolerance.
+
+    Splits at the sample with the largest error until every segment
+    fits (Douglas-Peucker). Constant samples reduce to a single key.
+    Segments whose ends fail connected(first, last) are split in any case,
+    at the middle if no sample is off by more than tolerance.
+    """
+    count = len(samples)
+    if not [s for s in samples if error(s, samples[0]) > tolerance]:
+        return [0]
+    keep = set([0, count - 1])
+    stack = [(0, count - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        duration = times[last] - times[first]
+        worst, worstError = None, tolerance
+        for i in range(first + 1, last):
+            t = 0.0
+            if duration > 0.0:
+                t = (times[i] - times[first]) / duration
+            e = error(interpolate(samples[first], samples[last], t), samples[i])
+            if e > worstError:
+                worst, worstError = i, e
+        if worst is None and connected and not connected(samples[first], samples[last]):
+            worst = (first + last) // 2
+        if worst is not None:
+            keep.add(worst)
+            stack.append((first, worst))
+            stack.append((worst, last))
+    return sorted(keep)
+
+
+def reduceTrack(name, times, samples, tolerance):
+    """ Returns the AnimationTrack of samples, one tuple per time, with as few
+    keys as tolerance allows. Rotations are quaternions, interpolated by slerp
+    and tolerance is an angle in radians, the others are interpolated linearly
+    and tolerance is a distance """
+    if name == "rotation":
+        # Aligned keys more than 180 degrees apart would be played back
+        # along the other, shorter arc
+        samples = alignQuaternions(samples)
+        keys = reduceKeys(times, samples, slerp, rotationAngle, tolerance,
+                          lambda a, b: sum([x * y for x, y in zip(a, b)]) >= 0.0)
+    else:
+        keys = reduceKeys(times, samples, lerp, distance, tolerance)
+    values = []
+    for k in keys:
+        values.extend(samples[k])
+    track = AnimationTrack(name, len(samples[0]), [times[k] for k in keys], values)
+    track.sampleCount = len(samples)
+    return track
@@ -0,0 +1,265 @@
+# --------------------------------------------------------------------------
+# XML3D exporter: value encoding
+# --------------------------------------------------------------------------
+# ***** BEGIN GPL LICENSE BLOCK *****
+#
+# Copyright (C) 2010: DFKI GmbH, kristian.sons@dfki.de
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+#
+# ***** END GPL LICENCE BLOCK *****
+# --------------------------------------------------------------------------
+
+import array
+import gzip
+import math
+import os
+import re
+import sys
+import threading
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Trailing zeros of a fraction, the fraction if it is zero altogether and
+# the sign of a zero. Each value of the formatted text ends with a blank.
+_TRAILING_ZEROS = re.compile(r'(\.[0-9]*?[1-9])0+ ')
+_ZERO_FRACTION = re.compile(r'\.0+ ')
+_NEGATIVE_ZERO = re.compile(r'(^| )-0 ')
+
+
+def formatFloats(values, digits):
+    """ Formats values with at most digits decimals and without trailing zeros
+
+    The whole array is formatted by a single format operation, zeros are
+    trimmed by regular expressions over the resulting text.
+    """
+    if numpy and isinstance(values, numpy.ndarray):
+        values = values.ravel().tolist()
+    if not len(values):
+        return ""
+    text = ("%%.%if " % digits * len(values)) % tuple(values)
+    text = _TRAILING_ZEROS.sub(r'\1 ', text)
+    text = _ZERO_FRACTION.sub(' ', text)
+    text = _NEGATIVE_ZERO.sub(r'\g<1>0 ', text)
+    # Overlapping matches of "-0 -0 " need a second pass
+    text = _NEGATIVE_ZERO.sub(r'\g<1>0 ', text)
+    return text[:-1]
+
+
+def formatInts(values):
+    if numpy and isinstance(values, numpy.ndarray):
+        values = values.ravel().tolist()
+    return ' '.join(map(str, values))
+
+
+def digitsForExtent(extent, tolerance):
+    """ Number of decimals that keeps the error below tolerance * extent """
+    if extent <= 0.0:
+        return 6
+    digits = int(math.ceil(-math.log10(extent * tolerance)))
+    return min(max(digits, 0), 9)
+
+
+class BinaryBufferFile:
+    """ A sidecar file holding attribute arrays as little-endian binary data
+
+    Values are appended as 32 bit floats ('f'), 32 bit signed integers
+    ('i'), 16 bit unsigned integers ('H') or 8 bit signed integers ('b'),
+    every array starting at a multiple of four bytes.
+    """
+
+    NUMPY_TYPES = { 'f': '<f4', 'i': '<i4', 'H': '<u2', 'b': 'i1' }
+    SMALL_TYPES = { 'H': 'uint16', 'b': 'int8' }
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = open(filename, 'wb')
+        self.offset = 0
+
+    def write(self, values, typecode):
+        """ Appends values and returns their byte offset and byte length """
+        if numpy and isinstance(values, numpy.ndarray):
+            data = numpy.ascontiguousarray(values, dtype=self.NUMPY_TYPES[typecode])
+            data.tofile(self.file)
+            length = data.nbytes
+        else:
+            data = array.array(typecode, values)
+            if sys.byteorder == 'big':
+                data.byteswap()
+            data.tofile(self.file)
+            length = len(data) * data.itemsize
+        offset = self.offset
+        self.offset += length
+        if self.offset % 4:
+            self.file.write(b'\0' * (4 - self.offset % 4))
+            self.offset += 4 - self.offset % 4
+        return offset, length
+
+    def close(self):
+        self.file.close()
+
+
+class CompressorThread:
+    """ Compresses the chunks passed to write into filename on a thread of its own
+
+    method is "gzip" or "brotli". zlib and brotli release the interpreter
+    lock while compressing, thus the thread runs alongside the serialization.
+    """
+
+    def __init__(self, filename, method, level):
+        self.filename = filename
+        self.error = None
+        if method == "gzip":
+            self._file = gzip.GzipFile(filename, 'wb', level)
+            self._compress = self._file.write
+            self._finish = None
+        elif method == "brotli":
+            if brotli is None:
+                raise ImportError("brotli output needs the brotli module")
+            self._file = open(filename, 'wb')
+            compressor = brotli.Compressor(quality=level)
+            self._compress = lambda chunk: self._file.write(compressor.process(chunk))
+            self._finish = lambda: self._file.write(compressor.finish())
+        else:
+            raise ValueError("Unknown compression: %s" % method)
+        # Bounded, so a slow compressor holds back the serialization
+        # instead of piling up the whole document in memory
+        self._queue = queue.Queue(16)
+        self._thread = threading.Thread(target=self._run)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            chunk = self._queue.get()
+            if chunk is None:
+                break
+            if self.error is None:
+                try:
+                    self._compress(chunk)
+                except Exception:
+                    self.error = sys.exc_info()[1]
+        try:
+            if self.error is None and self._finish:
+                self._finish()
+        except Exception:
+            self.error = sys.exc_info()[1]
+        self._file.close()
+
+    def write(self, chunk):
+        self._queue.put(chunk)
+
+    def close(self):
+        """ Waits for the compression to finish, raising its error if any """
+        self._queue.put(None)
+        self._thread.join()
+        if self.error is not None:
+            raise self.error
+
+
+def checkCompressions(compressions):
+    """ Raises if one of the (method, level) compressions of OutputFile cannot be written """
+    for method, level in compressions:
+        if method not in OutputFile.EXTENSIONS:
+            raise ValueError("Unknown compression: %s" % method)
+        if method == "brotli" and brotli is None:
+            raise ImportError("brotli output needs the brotli module")
+
+
+class OutputFile:
+    """ A writer for the document that fans out to the plain file and
+    precompressed copies of it.
+
+    compressions is a list of (method, level), the copies are named
+    filename + ".gz" or ".br". Text is encoded as UTF-8 and handed to the
+    compressors in chunks of chunkSize bytes.
+    """
+
+    EXTENSIONS = { "gzip": ".gz", "brotli": ".br" }
+
+    def __init__(self, filename, compressions=(), keepPlain=True, chunkSize=1 << 18):
+        self.filenames = []
+        self._sinks = []
+        self._pending = []
+        self._pendingSize = 0
+        self._chunkSize = chunkSize
+        if keepPlain or not compressions:
+            self._plain = open(filename, 'wb')
+            self.filenames.append(filename)
+        else:
+            self._plain = None
+        try:
+            for method, level in compressions:
+                sink = CompressorThread(filename + self.EXTENSIONS.get(method, ""), method, level)
+                self._sinks.append(sink)
+                self.filenames.append(sink.filename)
+        except:
+            self.close(True)
+            raise
+
+    def write(self, text):
+        if not isinstance(text, bytes):
+            text = text.encode('utf-8')
+        self._pending.append(text)
+        self._pendingSize += len(text)
+        if self._pendingSize >= self._chunkSize:
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        chunk = bytes().join(self._pending)
+        self._pending = []
+        self._pendingSize = 0
+        if self._plain:
+            self._plain.write(chunk)
+        for sink in self._sinks:
+            sink.write(chunk)
+
+    def close(self, discard=False):
+        """ Writes the rest and waits for the compressors. discard drops
+        pending text and removes the files, for exports that failed """
+        if discard:
+            self._pending = []
+        self.flush()
+        if self._plain:
+            self._plain.close()
+        error = None
+        for sink in self._sinks:
+            try:
+                sink.close()
+            except Exception:
+                error = error or sys.exc_info()[1]
+        if discard:
+            for filename in self.filenames:
+                try:
+                    os.remove(filename)
+                except OSError:
+                    pass
+        elif error is not None:
+            raise error
@@ -16,7 +16,7 @@ Exports Blender scene into XML3D format.
 
 Usage: run the script from the menu or inside Blender.  
 
-Notes: the script does not export animations yet.
+Notes: object animations are exported as keyframes if exportAnimation is set.
 """
 
 # --------------------------------------------------------------------------
@@ -43,83 +43,137 @@ Notes: the script does not export animations yet.
 # ***** END GPL LICENCE BLOCK *****
 # --------------------------------------------------------------------------
 
-from xml3d import XML3DDocument
-import sys
+from xml3d import XML3DStreamDocument
+from xml3d_mesh import MeshArrays, MeshOptions, MeshCache, encodeMesh, meshHash, boundingVolumes, transformArrays, mergeArrays
+from xml3d_encode import BinaryBufferFile, OutputFile, checkCompressions, formatFloats
+from xml3d_metrics import ExportMetrics
+from xml3d_texture import TextureOptions, processTexture, textureHash
+from xml3d_animation import axisAngleToQuaternion, reduceTrack
+import sys, os, math, itertools
+
+try:
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
 
 import Blender, bpy, BPyMesh #@UnresolvedImport
 from Blender import Mesh, Window, Mathutils, Material #@UnresolvedImport
 
 DEG2RAD = 0.017453292519943295
 
-class vertex:
-    index = None
-    normal = None
-    texcoord = None
-    color = None
-    
-    def veckey3d(self, v):
-        if v == None:
-            return None
-        return Mathutils.Vector(round(v.x, 8), round(v.y, 8), round(v.z, 8))
-
-    def veckey2d(self, v):
-        if v == None:
-            return None
-        return Mathutils.Vector(round(v.x, 8), round(v.y, 8))
-
-    def __init__(self, index, normal = None, texcoord = None, color = None):
-        self.index = index
-        self.normal = self.veckey3d(normal)
-        self.texcoord = self.veckey2d(texcoord)
-    
-    def __str__( self ) :
-        return "i: " + str( self.index ) + ", n: " + str( self.normal ) + ", t: " + str( self.texcoord )
- 
-    def __cmp__(self, other):
-        "Currently not used as __eq__ has higher priority"
-        #print "Compare"
-        if self.index < other.index:
-            return -1;
-        if self.index > other.index:
-            return 1;
-        
-        if self.normal != other.normal:
-            if self.normal == None:
-                return -1;
-            if other.normal == None:
-                return 1;
-            return cmp(self.normal, other.normal)
-
-        if self.texcoord != other.texcoord:
-            if self.texcoord == None:
-                return -1;
-            if other.texcoord == None:
-                return 1;
-            return cmp(self.texcoord, other.texcoord)
-
-        return 0;
- 
-    def __hash__( self ) :
-        return self.index
-
-                   
-    def __eq__(self, other):
-        return self.index == other.index and self.normal == other.normal and self.texcoord == other.texcoord
-        
-
-def appendUnique(mlist, value):
-    if value in mlist:
-        return mlist[value], False
-    # Not in dict, thus add it
-    index = len(mlist)
-    mlist[value] = index
-    return index, True    
+class MeshBatch:
+    """ Static mesh objects merged into one mesh of a single material """
     
+    def __init__(self, name, material):
+        self.name = name
+        self.material = material  # None for faces without material
+        self.materials = material and [material] or []
+        self.parts = []           # (transformed arrays, material index)
+
 class xml3d_exporter:
     
     annotatePhysics = False
+    # Write mesh attributes into a binary sidecar file instead of inlining them
+    binaryBuffers = False
+    # Decimals of text output. Positions keep their error below
+    # positionTolerance times the extent of the mesh' bounding box
+    positionTolerance = 1e-5
+    normalDigits = 4
+    texcoordDigits = 5
+    floatDigits = 6
+    # Precompressed copies of the page, written while it is generated.
+    # "gzip" writes <filename>.gz, "brotli" <filename>.br (needs the
+    # brotli module). keepUncompressed also writes the plain file
+    outputCompression = ()
+    gzipLevel = 9
+    brotliLevel = 9
+    keepUncompressed = True
+    # Copy the images of textures into textureDir next to the output,
+    # one file per distinct content. With PIL they are scaled down to
+    # textureMaxSize, to powers of two if texturePowerOfTwo, and saved as
+    # textureFormat ("png", "jpeg" or None for png only with alpha), with
+    # smaller levels <name>-mip1, -mip2, ... if textureMipmaps. The
+    # mipmaps attribute of the texture element lists their URLs.
+    # Files from earlier exports with the same content and settings are kept
+    exportTextures = False
+    textureDir = "textures"
+    textureMaxSize = 2048
+    texturePowerOfTwo = True
+    textureFormat = None
+    textureQuality = 90
+    textureMipmaps = False
+    textureFiles = {}
+    shaderIds = {}
+    world = None
+    sceneObjects = []
+    # Reorder triangles and vertices for a GPU vertex cache with this
+    # many entries, 0 keeps Blender's face order
+    vertexCacheSize = 0
+    # Write triangle strips for materials where they need fewer indices
+    triangleStrips = False
+    # Triangle ratios of simplified levels of detail, written as index
+    # data blocks <mesh>_data_lod1, <mesh>_data_lod2, ... next to the mesh.
+    # The lods attribute of the full index data block lists their ids, each
+    # level has lod-ratio and lod-error (object space) attributes
+    lodRatios = ()
+    # Meshes with more vertices are split into spatially compact chunks
+    # that can be drawn with 16 bit indices, 0 never splits
+    maxChunkVertices = 65535
+    # Bounding boxes and spheres on every mesh data block and world space
+    # bounds on every mesh group, so clients can cull without scanning
+    exportBounds = True
+    # Write positions and texcoords as 16 bit integers over the range of
+    # each chunk, still in their float3 and float2 elements, decoded with
+    # <name>Scale and <name>Offset, and normals as
+    # two 8 bit integers in octahedral encoding. Smallest with binaryBuffers
+    quantizeAttributes = False
+    # Average the normals of flat faces at shared vertices with neighbouring
+    # flat faces that differ by at most autoSmoothAngle degrees, thus their
+    # corners become one vertex. 0 keeps one normal per flat face
+    autoSmoothAngle = 0.0
+    # Merge mesh objects without animation or parent into one mesh per material and
+    # cell of a grid with batchCellSize, their transforms baked into the
+    # vertices. With 0 all objects of a material end up in one mesh
+    staticBatching = False
+    batchCellSize = 0.0
+    batches = []
+    batchedObjects = {}
+    # Sample the transforms of objects with an object Ipo at every
+    # animationStep-th frame of the render range. Tracks keep only the keys
+    # needed to stay within the tolerances (scene units, degrees for
+    # rotations) and go to a data block a_<object> of <track>Key times in
+    # seconds and translation, rotation (quaternions) and scale values.
+    # The animation attribute of the object's transform refers to it
+    exportAnimation = False
+    animationStep = 1
+    animationTranslationTolerance = 1e-3
+    animationRotationTolerance = 0.1
+    animationScaleTolerance = 1e-3
+    animations = {}
+    # Worker processes for mesh encoding, None for one per CPU. Workers
+    # need picklable functions and jobs, which the merged script run by
+    # Blender does not provide, thus they are only used if set explicitly
+    meshProcesses = 1
+    # Directory of the encoded mesh cache, None disables it. The cache
+    # is trimmed to meshCacheSize bytes, least recently used entries first.
+    # Other users must not be able to write to it
+    meshCacheDir = None
+    meshCacheSize = 512 * 1024 * 1024
+    meshCache = None
+    pool = None
+    poolFailed = False
+    sharedMeshData = {}
+    meshChunks = {}
+    meshBounds = {}
+    # Write phase timings and mesh statistics to <name>-metrics.json.
+    # traceMemory measures peak memory per phase with tracemalloc (slow)
+    metricsReport = True
+    traceMemory = False
+    metrics = None
+    containerMesh = None
     noMaterialAppeared = False
     doc = None
+    buffers = None
     
     def __init__(self, filename, withGUI):
         self.filename = filename
@@ -128,6 +182,10 @@ class xml3d_exporter:
        
         
     def getContainerMesh(self, createNew=True):
+        """ The scratch mesh for BPyMesh.getMeshFromObject. It is looked up
+        or created on first use and reused until releaseContainerMesh """
+        if self.containerMesh is not None:
+            return self.containerMesh
         temp_mesh_name = '~tmp-mesh'
         containerMesh = meshName = tempMesh = None
         for meshName in Blender.NMesh.GetNames():
@@ -139,12 +197,19 @@ class xml3d_exporter:
             containerMesh = Mesh.New(temp_mesh_name)
         del meshName
         del tempMesh
+        self.containerMesh = containerMesh
         return containerMesh
     
+    def releaseContainerMesh(self):
+        if self.containerMesh is not None:
+            self.containerMesh.verts = None
+            self.containerMesh = None
+    
     def writeMeshObject(self, obj, parent):
         #print 'Writing: ' , obj.name
         
         aMesh = obj.getData()
+        dataMesh = self.sharedMeshData.get(aMesh.name, aMesh)
 
         group = self.doc.createGroupElement()
         parent.appendChild(group)
@@ -154,145 +219,402 @@ class xml3d_exporter:
             group.setAttribute("physics-material", "#phy_" + obj.name)
         
         matCount = len(aMesh.materials)
+        if matCount == 0:
+            group.setShader("#_no_mat")
+        elif matCount == 1:
+            group.setShader("#" + self.getShaderId(aMesh.materials[0].name))
+        
+        # Attributes have to be set before the first child is appended,
+        # the start tag is written out then
+        if self.exportBounds and dataMesh.name in self.meshBounds:
+            self.writeBounds(group, self.getWorldBounds(obj, self.meshBounds[dataMesh.name]))
+        
+        # Mesh types per material of every chunk, None if a chunk
+        # has no triangles of a material
+        chunks = self.meshChunks.get(dataMesh.name, [()])
+        
         if matCount < 2:
-            self.writeDefaultShader()
-            if matCount == 0:
-                group.setShader("#_no_mat")
-            else:
-                group.setShader("#" + aMesh.materials[0].name)
-            mesh = self.doc.createMeshElement(None, None, "triangles", "#" + aMesh.name + "_data")
-            group.appendChild(mesh)
+            for c, types in enumerate(chunks):
+                src = "#" + self.getDataName(dataMesh.name, c, len(chunks))
+                mesh = self.doc.createMeshElement(None, None, self.getMeshType(types, 0), src)
+                group.appendChild(mesh)
         else:
-            for material in aMesh.materials:
-                shaderName = "#" + material.name
+            for i, material in enumerate(aMesh.materials):
+                shaderName = "#" + self.getShaderId(material.name)
                 subgroup = self.doc.createGroupElement(shader_ = shaderName)
                 group.appendChild(subgroup)
-                mesh = self.doc.createMeshElement(type_ = "triangles")
-                mesh.setSrc("#" + aMesh.name + "_data_" + material.name)
-                subgroup.appendChild(mesh)
+                for c, types in enumerate(chunks):
+                    if i < len(types) and types[i] is None:
+                        continue
+                    mesh = self.doc.createMeshElement(type_ = self.getMeshType(types, i))
+                    mesh.setSrc("#" + self.getDataName(dataMesh.name, c, len(chunks), dataMesh.materials[i].name))
+                    subgroup.appendChild(mesh)
             
         
         
 
-    def writeMeshData(self, parent, mesh, obj):
-        
+    def getMeshType(self, types, materialIndex):
+        if materialIndex < len(types) and types[materialIndex]:
+            return types[materialIndex]
+        return "triangles"
+    
+    def getDataName(self, meshName, chunk, chunkCount, materialName=None):
+        """ The id of the data block of a chunk of a mesh, or of the indices
+        of one of its materials """
+        name = meshName + "_data"
+        if chunkCount > 1:
+            name += "_chunk%i" % chunk
+        if materialName is not None:
+            name += "_" + materialName
+        return name
+
+    def getMeshJob(self, mesh, obj):
+        """ Copies the evaluated geometry of obj, returns None if it has no faces.
+        Quads are triangulated later on the copy, the scene stays untouched """
+        self.metrics.begin("mesh extraction")
         aMesh = BPyMesh.getMeshFromObject(obj, self.getContainerMesh(), True, scn=self.scene)
         
         if len(aMesh.faces) == 0:
-            return
-        
-        print("Writing mesh %s" % mesh.name)
-        
-        materials = aMesh.materials
+            self.metrics.end("mesh extraction")
+            return None
         
-        has_quads = False
-        for f in aMesh.faces:
-            if len(f) == 4:
-                has_quads = True
+        arrays = self.getMeshArrays(aMesh)
+        self.metrics.end("mesh extraction")
+        return arrays, self.getMeshOptions()
+    
+    def getMeshOptions(self):
+        options = MeshOptions()
+        options.binary = self.buffers is not None
+        options.positionTolerance = self.positionTolerance
+        options.normalDigits = self.normalDigits
+        options.texcoordDigits = self.texcoordDigits
+        options.vertexCacheSize = self.vertexCacheSize
+        options.triangleStrips = self.triangleStrips
+        options.lodRatios = tuple(self.lodRatios)
+        options.maxChunkVertices = self.maxChunkVertices
+        options.quantize = self.quantizeAttributes
+        options.autoSmoothAngle = self.autoSmoothAngle
+        return options
+    
+    def getProcessCount(self):
+        """ The number of worker processes to use, 1 to run serially """
+        processes = self.meshProcesses
+        if not processes and multiprocessing:
+            try:
+                processes = multiprocessing.cpu_count()
+            except NotImplementedError:
+                processes = 1
+        # On Windows workers are spawned from sys.executable, which is
+        # Blender itself, thus they cannot import the exporter
+        if not multiprocessing or os.name == 'nt' or self.poolFailed:
+            return 1
+        return max(processes, 1)
+    
+    def getPool(self):
+        """ The pool of worker processes, started on first use, or None """
+        if self.pool is None and self.getProcessCount() > 1:
+            try:
+                self.pool = multiprocessing.Pool(self.getProcessCount())
+            except (OSError, ImportError):
+                print("WARNING: Could not start worker processes, running serially")
+                self.poolFailed = True
+        return self.pool
+    
+    def closePool(self, terminate=False):
+        if self.pool is not None:
+            if terminate:
+                self.pool.terminate()
+            else:
+                self.pool.close()
+            self.pool.join()
+            self.pool = None
+    
+    def iterJobs(self, function, jobs):
+        """ Yields function(job) for each of the list jobs in order, computed
+        by the worker pool if there is one and as soon as it is done """
+        done = 0
+        if len(jobs) > 1 and self.getPool():
+            try:
+                for result in self.pool.imap(function, jobs):
+                    done += 1
+                    yield result
+            except Exception:
+                # Pickling fails if the exporter is not an importable module
+                print("WARNING: Worker processes failed (%s), running serially" % sys.exc_info()[1])
+                self.closePool(True)
+                self.poolFailed = True
+        for job in jobs[done:]:
+            yield function(job)
+    
+    def runJobs(self, function, jobs):
+        """ Maps function over jobs in the pool of meshProcesses worker processes,
+        or serially if there is no pool """
+        return list(self.iterJobs(function, jobs))
+    
+    def encodeCachedMeshes(self, items):
+        """ Yields (mesh, encoded) for an iterable of (mesh, content hash, job),
+        in its order. Meshes not in the cache are encoded, encoded is None for
+        items without job.
+        
+        Items are taken a few per worker process at a time, and one at a time
+        without workers, thus only the meshes in flight are held in memory.
+        """
+        items = iter(items)
+        windowSize = 1
+        if self.getProcessCount() > 1:
+            windowSize = self.getProcessCount() * 2
+        while True:
+            window = list(itertools.islice(items, windowSize))
+            if not window:
                 break
+            encodedMeshes = [None] * len(window)
+            missing = []
+            for i, (mesh, contentHash, job) in enumerate(window):
+                if job is None:
+                    continue
+                if self.meshCache:
+                    encodedMeshes[i] = self.meshCache.get(contentHash)
+                if encodedMeshes[i] is None:
+                    missing.append(i)
+            results = self.iterJobs(encodeMesh, [window[i][2] for i in missing])
+            for i in range(len(window)):
+                mesh, contentHash, job = window[i]
+                window[i] = None
+                encoded, encodedMeshes[i] = encodedMeshes[i], None
+                if i in missing:
+                    encoded = next(results)
+                    self.metrics.addTimes(encoded.times)
+                    if self.meshCache:
+                        self.meshCache.put(contentHash, encoded)
+                yield mesh, encoded
+        if self.meshCache:
+            self.meshCache.evict()
+    
+    def writeMeshData(self, parent, mesh, encoded):
         
-        if has_quads:
-            oldmode = Mesh.Mode()
-            Mesh.Mode(Mesh.SelectModes['FACE'])
-            
-            aMesh.sel = True
-            tempob = self.scene.objects.new(aMesh)
-            aMesh.quadToTriangle(0) # more=0 shortest length
-            oldmode = Mesh.Mode(oldmode)
-            self.scene.objects.unlink(tempob)
-            
-            Mesh.Mode(oldmode)
+        print("Writing mesh %s" % mesh.name)
+        print("Faces: %i" % encoded.faceCount)
+        print("Triangles: %i" % encoded.triangleCount)
+        print("Vertices: %i" % encoded.vertexCount)
+        if len(encoded.chunks) > 1:
+            print("Chunks: %i" % len(encoded.chunks))
+        if encoded.acmr:
+            print("ACMR: %.3f -> %.3f" % encoded.acmr)
+        
+        chunkTypes = []
+        size = 0
+        for c, chunk in enumerate(encoded.chunks):
+            name = self.getDataName(mesh.name, c, len(encoded.chunks))
+            size += self.writeChunkData(parent, mesh, name, chunk)
+            types = []
+            for meshType, payload in zip(chunk.types, chunk.indices):
+                if payload is None:
+                    meshType = None
+                types.append(meshType)
+            chunkTypes.append(types)
+        self.meshChunks[mesh.name] = chunkTypes
+        self.meshBounds[mesh.name] = encoded.bounds
+        
+        # Levels of detail of all chunks together
+        lods = []
+        for level in range(len(encoded.chunks[0].lods)):
+            levels = [chunk.lods[level] for chunk in encoded.chunks]
+            triangles = sum([lod[1] for lod in levels])
+            error = max([lod[2] for lod in levels])
+            print("LOD %i: %i triangles, error %g" % (level + 1, triangles, error))
+            lods.append({ "ratio": levels[0][0], "triangles": triangles, "error": error,
+                          "relativeError": max([lod[3] for lod in levels]) })
+        
+        # Largest error of all chunks together
+        quantizationErrors = None
+        if encoded.chunks[0].quantizationErrors:
+            quantizationErrors = {}
+            for name in encoded.chunks[0].quantizationErrors:
+                quantizationErrors[name] = max([chunk.quantizationErrors[name] for chunk in encoded.chunks])
+            print("Quantization error: " + ", ".join(["%s %g" % item for item in sorted(quantizationErrors.items())]))
+        
+        self.metrics.addMesh(mesh.name, encoded.faceCount, encoded.triangleCount, encoded.cornerCount, encoded.vertexCount, size,
+                             encoded.acmr, lods, quantizationErrors)
+        
+    def writeChunkData(self, parent, mesh, name, chunk):
+        """ Writes the data blocks of one chunk of a mesh, returns the number of bytes written """
+        materials = mesh.materials
         
-        data = self.doc.createDataElement(mesh.name+"_data", None, None, None, None)    
+        data = self.doc.createDataElement(name, None, None, None, None)    
+        if not len(materials) > 1:
+            self.setLodLinks(data, name, None, chunk, 0)
         parent.appendChild(data)
         
-        # Mesh indices
-        matCount = len(materials)
-        if matCount == 0:
-            matCount = 1
-        indices = [[] for m in range(matCount)] #@UnusedVariable
-        vertices = []
-        vertex_dict = {}
-       
-        print("Faces: %i" % len(aMesh.faces))
-        
-        i = 0
-        for face in aMesh.faces:
-            mv = None
-            for i, v in enumerate(face):
-                if face.smooth:
-                    if aMesh.faceUV:
-                        mv = vertex(v.index, None, face.uv[i])
-                    else:
-                        mv = vertex(v.index, None, None)
-                else:
-                    if aMesh.faceUV:
-                        mv = vertex(v.index, face.no, face.uv[i])
-                    else:
-                        mv = vertex(v.index, face.no)
-                index, added = appendUnique(vertex_dict, mv)
-                indices[face.mat].append(index)
-                if added:
-                    vertices.append(mv)
-
-
         # Single or no material: write all in one data block
-        if not matCount > 1:
+        size = 0
+        indexType = self.getIndexType(chunk)
+        if not len(materials) > 1:
             valueElement = self.doc.createIntElement(None, "index")
-            valueElement.setValue(' '.join(map(str, indices[0])))
+            size += self.setArray(valueElement, chunk.indices[0], indexType)
             data.appendChild(valueElement)
        
-        print("Vertices: %i" % len(vertex_dict))
-        
-        # Vertex positions
-        value_list = []
-        for v in vertices:
-            value_list.append("%.6f %.6f %.6f" % tuple(aMesh.verts[v.index].co))
-                
-        valueElement = self.doc.createFloat3Element(None, "position")
-        valueElement.setValue(' '.join(value_list))
-        data.appendChild(valueElement)
-        
-        # Vertex normals
-        value_list = []
-        for v in vertices:
-            if v.normal == None:
-                value_list.append("%.6f %.6f %.6f" % tuple(aMesh.verts[v.index].no))
-            else:
-                value_list.append("%.6f %.6f %.6f" % tuple(v.normal))
-     
-        valueElement = self.doc.createFloat3Element(None, "normal")
-        valueElement.setValue(' '.join(value_list))
-        data.appendChild(valueElement)
-
-        # Vertex texCoord
-        if aMesh.faceUV:
-            value_list = []
-            for v in vertices:
-                value_list.append("%.6f %.6f" % tuple(v.texcoord))
-    
-            valueElement =self. doc.createFloat2Element(None, "texcoord")
-            valueElement.setValue(' '.join(value_list))
-            data.appendChild(valueElement);
+        # Vertex positions, normals and texCoords
+        for element, attributeName, typecode, payload in chunk.attributes:
+            valueElement = getattr(self.doc, "create%sElement" % element.capitalize())(None, attributeName)
+            size += self.setArray(valueElement, payload, typecode)
+            data.appendChild(valueElement)
+        if self.exportBounds:
+            self.writeBounds(data, chunk.bounds)
             
         if len(materials) > 1:
             for i, material in enumerate(materials):
-                if len(indices[i]) == 0:
+                if chunk.indices[i] is None:
                     continue
                 
-                data = self.doc.createDataElement(mesh.name+"_data_" + material.name, None, None, None, None)    
+                data = self.doc.createDataElement(name + "_" + material.name, None, None, None, None)    
+                self.setLodLinks(data, name, material.name, chunk, i)
                 parent.appendChild(data)
 
-                refdata = self.doc.createDataElement(src_="#"+mesh.name+"_data")
+                refdata = self.doc.createDataElement(src_="#" + name)
                 data.appendChild(refdata)
 
                 valueElement = self.doc.createIntElement(None, "index")
-                valueElement.setValue(' '.join(map(str, indices[i])))
+                size += self.setArray(valueElement, chunk.indices[i], indexType)
                 data.appendChild(valueElement)
-       
-        aMesh.verts = None
         
+        for level, lod in enumerate(chunk.lods):
+            size += self.writeLodData(parent, mesh, name, level + 1, lod, indexType)
+        return size
+    
+    def getIndexType(self, chunk):
+        """ The typecode of the indices of chunk in the binary buffer, 16 bit
+        if all of its vertices can be addressed by them """
+        if chunk.vertexCount <= 65535:
+            return 'H'
+        return 'i'
+    
+    def getLodName(self, name, materialName, level):
+        """ The id of the data block of a level of detail of the vertex data
+        block name, of the indices of one material if there are several """
+        if materialName is not None:
+            return "%s_%s_lod%i" % (name, materialName, level)
+        return "%s_lod%i" % (name, level)
+    
+    def setLodLinks(self, data, name, materialName, chunk, materialIndex):
+        """ Refers the data block with the full indices of a material to the
+        data blocks of its levels of detail, by an attribute lods of their
+        ids from finest to coarsest """
+        links = ["#" + self.getLodName(name, materialName, level + 1)
+                 for level, lod in enumerate(chunk.lods) if lod[4][materialIndex] is not None]
+        if links:
+            data.setAttribute("lods", " ".join(links))
+        
+    def writeLodData(self, parent, mesh, name, level, lod, indexType):
+        """ Writes the indices of a level of detail, referring to the vertex
+        data block name. The attributes lod-ratio and lod-error hold the share
+        of the original triangles and the largest distance in object space
+        of a moved vertex to its original surface. Returns the number of bytes
+        written """
+        size = 0
+        materials = mesh.materials
+        for i, payload in enumerate(lod[4]):
+            if payload is None:
+                continue
+            materialName = None
+            if len(materials) > 1:
+                materialName = materials[i].name
+            data = self.doc.createDataElement(self.getLodName(name, materialName, level), None, None, None, None)
+            data.setAttribute("lod-ratio", self.formatValues(lod[0]))
+            data.setAttribute("lod-error", self.formatValues(lod[2]))
+            parent.appendChild(data)
+            data.appendChild(self.doc.createDataElement(src_="#" + name))
+            
+            valueElement = self.doc.createIntElement(None, "index")
+            size += self.setArray(valueElement, payload, indexType)
+            data.appendChild(valueElement)
+        return size
+        
+        
+    def writeBounds(self, parent, bounds):
+        """ Appends the box minimum and maximum and the sphere (center, radius) as values """
+        lower, upper, center, radius = bounds
+        for name, values in (("boundingBoxMin", lower), ("boundingBoxMax", upper)):
+            valueElement = self.doc.createFloat3Element(None, name)
+            valueElement.setValue(self.formatValues(*values))
+            parent.appendChild(valueElement)
+        valueElement = self.doc.createFloat4Element(None, "boundingSphere")
+        valueElement.setValue(self.formatValues(center[0], center[1], center[2], radius))
+        parent.appendChild(valueElement)
+    
+    def getObjectMatrix(self, obj):
+        """ The transform written by writeTransform as three rows of (x, y, z, translation):
+        scale, rotate around the axis (Rodrigues), translate. It combines the world
+        rotation with the local location and size, thus it is the world transform
+        of objects without a parent only """
+        quat = obj.matrix.rotationPart().toQuat()
+        axis = [quat.axis[0], quat.axis[1], quat.axis[2]]
+        length = (axis[0] ** 2 + axis[1] ** 2 + axis[2] ** 2) ** 0.5
+        if length > 0.0:
+            axis = [a / length for a in axis]
+        angle = quat.angle * DEG2RAD
+        cos, sin = math.cos(angle), math.sin(angle)
+        cross = [[0.0, -axis[2], axis[1]], [axis[2], 0.0, -axis[0]], [-axis[1], axis[0], 0.0]]
+        scale = (obj.SizeX, obj.SizeY, obj.SizeZ)
+        translation = (obj.LocX, obj.LocY, obj.LocZ)
+        matrix = []
+        for i in range(3):
+            row = [((i == j) * cos + cross[i][j] * sin + axis[i] * axis[j] * (1.0 - cos)) * scale[j] for j in range(3)]
+            matrix.append(row + [translation[i]])
+        return matrix
+    
+    def getWorldBounds(self, obj, bounds):
+        """ Transforms object space bounds like the transform written by writeTransform """
+        lower, upper, center, radius = bounds
+        matrix = self.getObjectMatrix(obj)
+        
+        def transform(point):
+            return [row[0] * point[0] + row[1] * point[1] + row[2] * point[2] + row[3] for row in matrix]
+        
+        corners = [transform((x, y, z)) for x in (lower[0], upper[0])
+                   for y in (lower[1], upper[1]) for z in (lower[2], upper[2])]
+        worldLower = [min([p[i] for p in corners]) for i in range(3)]
+        worldUpper = [max([p[i] for p in corners]) for i in range(3)]
+        worldRadius = radius * max([abs(s) for s in (obj.SizeX, obj.SizeY, obj.SizeZ)])
+        return worldLower, worldUpper, transform(center), worldRadius
+    
+    def setArray(self, valueElement, payload, typecode):
+        """ Stores payload in the sidecar buffer or as text of valueElement.
+        Returns the number of bytes written """
+        if self.buffers:
+            offset, length = self.buffers.write(payload, typecode)
+            valueElement.setBuffer(os.path.basename(self.buffers.filename), offset, length)
+            # 32 bit values need no type, their element tells
+            if typecode in BinaryBufferFile.SMALL_TYPES:
+                valueElement.setAttribute("componentType", BinaryBufferFile.SMALL_TYPES[typecode])
+            return length
+        valueElement.setValue(payload)
+        return len(payload)
+    
+    def formatValues(self, *values):
+        return formatFloats(values, self.floatDigits)
+    
+    def getMeshArrays(self, aMesh):
+        """ Copies the geometry of aMesh into flat lists """
+        arrays = MeshArrays()
+        for v in aMesh.verts:
+            arrays.positions.extend(v.co)
+            arrays.vertexNormals.extend(v.no)
         
+        if aMesh.faceUV:
+            arrays.uvs = []
+        for face in aMesh.faces:
+            arrays.faceSizes.append(len(face))
+            arrays.corners.extend([v.index for v in face])
+            arrays.faceNormals.extend(face.no)
+            arrays.faceSmooth.append(face.smooth)
+            arrays.faceMaterials.append(face.mat)
+            if aMesh.faceUV:
+                for uv in face.uv:
+                    arrays.uvs.extend(uv)
+        
+        arrays.materialCount = max(len(aMesh.materials), 1)
+        return arrays
+    
     def writeMainDef(self, parent):
         defElement = self.doc.createDefsElement("mainDef")
         defElement.setIdAttribute( "id" )
@@ -301,17 +623,20 @@ class xml3d_exporter:
         
         meshes, lights, cameras = {}, {}, {}
         
-        print("Objects: %i" % len(bpy.data.objects))
-        for obj in bpy.data.objects:
-            
-            if obj.restrictRender or obj.users == 0:
-                continue
+        self.sceneObjects = self.collectSceneObjects()
+        print("Objects: %i of %i" % (len(self.sceneObjects), len(bpy.data.objects)))
+        self.batchedObjects = {}
+        staticObjects = []
+        for obj in self.sceneObjects:
             
             objType = obj.getType( )
             dataName = obj.getData( True )
             data = obj.getData( False, True )
             
-            if objType == 'Mesh':
+            if objType == 'Mesh' and self.isBatchable(obj):
+                staticObjects.append(obj)
+                self.batchedObjects[obj.name] = True
+            elif objType == 'Mesh':
                 meshes[ dataName ] = data, obj
             elif objType == 'Lamp':
                 lights[ dataName ] = data
@@ -319,20 +644,196 @@ class xml3d_exporter:
                 cameras[ dataName ] = data
         
         
-        for obj in bpy.data.objects:
-            self.writeTransform(defElement, obj)
+        self.animations = {}
+        if self.exportAnimation:
+            self.metrics.begin("animation")
+            self.animations = self.sampleAnimations([obj for obj in self.sceneObjects
+                                                     if obj.ipo and obj.getType() in ('Mesh', 'Lamp')])
+            self.metrics.end("animation")
+        
+        self.metrics.begin("transforms")
+        # Only groups refer to transforms
+        for obj in self.sceneObjects:
+            if obj.getType() in ('Mesh', 'Lamp') and obj.name not in self.batchedObjects:
+                self.writeTransform(defElement, obj)
+        self.metrics.end("transforms")
+        
+        # The default shader has to be known before mainDef is written out
+        for obj in self.sceneObjects:
+            if obj.getType() == 'Mesh' and len(obj.getData(mesh=True).materials) == 0:
+                self.writeDefaultShader(defElement)
+                break
         
-        for key in meshes:
-            rawMesh, obj = meshes[ key ]
-            self.writeMeshData(defElement, rawMesh, obj)
+        # Meshes are extracted, encoded and written one after another, or a
+        # few at a time with worker processes. Meshes with the same geometry
+        # as an earlier one share its data block
+        self.sharedMeshData = {}
+        self.meshChunks = {}
+        self.meshBounds = {}
+        meshJobs = {}
+        batchedMeshes = dict([(obj.getData(True), True) for obj in staticObjects])
+        for rawMesh, encoded in self.encodeCachedMeshes(self.getMeshItems(meshes, meshJobs, batchedMeshes)):
+            if encoded:
+                self.writeMeshData(defElement, rawMesh, encoded)
             if (self.annotatePhysics):
                 self.writePhysicsMaterial(defElement, rawMesh);
-        
-        for lamp in bpy.data.lamps:
-            self.writeLightShader(defElement, lamp)
+        if self.sharedMeshData:
+            print("Meshes sharing geometry: %i" % len(self.sharedMeshData))
+        
+        self.batches = self.getBatches(staticObjects, meshJobs)
+        del meshJobs
+        for batch, encoded in self.encodeCachedMeshes(self.getBatchItems(self.batches)):
+            self.writeMeshData(defElement, batch, encoded)
+        
+        if self.exportTextures:
+            self.metrics.begin("textures")
+            self.processTextures()
+            self.metrics.end("textures")
+        
+        self.metrics.begin("shaders")
+        self.world = Blender.World.GetCurrent()
+        self.writeShaders(defElement)
+        self.metrics.end("shaders")
+    
+    def getMeshItems(self, meshes, meshJobs, batchedMeshes):
+        """ Yields (mesh, content hash, job) for the (mesh, object) pairs of
+        meshes, job is None for meshes without faces or sharing the data of an
+        earlier one. Jobs of batchedMeshes are kept in meshJobs for getBatches """
+        firstMeshes = {}
+        for key in meshes:
+            rawMesh, obj = meshes[ key ]
+            job = self.getMeshJob(rawMesh, obj)
+            if key in batchedMeshes:
+                meshJobs[key] = job
+            contentHash = None
+            if job:
+                contentHash = meshHash(*job)
+                if contentHash in firstMeshes:
+                    self.sharedMeshData[key] = meshes[ firstMeshes[contentHash] ][0]
+                    job = None
+                else:
+                    firstMeshes[contentHash] = key
+            yield rawMesh, contentHash, job
+    
+    def getBatchItems(self, batches):
+        """ Yields (batch, content hash, job) for batches, merging the parts
+        of each batch only when it is its turn """
+        for batch in batches:
+            job = (mergeArrays(batch.parts), self.getMeshOptions())
+            batch.parts = None
+            yield batch, meshHash(*job), job
+    
+    def isBatchable(self, obj):
+        """ Whether the geometry of obj can be baked into a static batch. The
+        matrix of getObjectMatrix is only the world transform of objects
+        without a parent, thus children keep their own transform """
+        return (self.staticBatching and not self.annotatePhysics and not obj.parent
+                and not self.isAnimated(obj))
+    
+    def isAnimated(self, obj):
+        """ Whether obj or one of its parents has an object Ipo """
+        while obj:
+            if obj.ipo:
+                return True
+            obj = obj.parent
+        return False
+    
+    def getBatches(self, objects, meshJobs):
+        """ Groups the faces of objects by material and grid cell into MeshBatch
+        instances. meshJobs are the mesh jobs by mesh name extracted already """
+        batches = {}
+        keys = []
+        for obj in objects:
+            mesh = obj.getData(mesh=True)
+            if mesh.name not in meshJobs:
+                meshJobs[mesh.name] = self.getMeshJob(mesh, obj)
+            job = meshJobs[mesh.name]
+            if not job:
+                continue
+            arrays = transformArrays(job[0], self.getObjectMatrix(obj))
             
-        for material in bpy.data.materials:
-            self.writePhongShader(defElement, material)
+            # Objects stay whole, they go to the cell of their center
+            cell = ()
+            if self.batchCellSize > 0.0:
+                center = boundingVolumes(arrays.positions)[2]
+                cell = tuple([int(math.floor(c / self.batchCellSize)) for c in center])
+            
+            usedMaterials = {}
+            for m in arrays.faceMaterials:
+                usedMaterials[m] = True
+            for m in sorted(usedMaterials):
+                material = None
+                if m < len(mesh.materials):
+                    material = mesh.materials[m]
+                key = (material and material.name, cell)
+                if key not in batches:
+                    batches[key] = MeshBatch("_batch%i" % len(keys), material)
+                    keys.append(key)
+                batches[key].parts.append((arrays, m))
+        
+        if objects:
+            print("Static batches: %i for %i objects" % (len(keys), len(objects)))
+        return [batches[key] for key in keys]
+    
+    def sampleAnimations(self, objects):
+        """ Samples location, rotation and scale of objects over the render range.
+        Returns the reduced AnimationTracks by object name, tracks without
+        change are left out """
+        renderData = self.scene.getRenderingContext()
+        frames = range(renderData.sFrame, renderData.eFrame + 1, max(self.animationStep, 1))
+        fps = renderData.fps / float(renderData.fpsBase)
+        times = [(frame - renderData.sFrame) / fps for frame in frames]
+        
+        # One frame change updates all objects, thus frames are the outer loop
+        samples = dict([(obj.name, ([], [], [])) for obj in objects])
+        currentFrame = Blender.Get('curframe')
+        try:
+            for frame in frames:
+                Blender.Set('curframe', frame)
+                for obj in objects:
+                    translations, rotations, scales = samples[obj.name]
+                    quat = obj.matrix.rotationPart().toQuat()
+                    translations.append((obj.LocX, obj.LocY, obj.LocZ))
+                    rotations.append(axisAngleToQuaternion(quat.axis, quat.angle * DEG2RAD))
+                    scales.append((obj.SizeX, obj.SizeY, obj.SizeZ))
+        finally:
+            Blender.Set('curframe', currentFrame)
+        
+        tolerances = (self.animationTranslationTolerance, self.animationRotationTolerance * DEG2RAD,
+                      self.animationScaleTolerance)
+        animations = {}
+        sampleCount = keyCount = 0
+        for obj in objects:
+            tracks = []
+            for name, values, tolerance in zip(("translation", "rotation", "scale"), samples[obj.name], tolerances):
+                track = reduceTrack(name, times, values, tolerance)
+                if len(track.times) > 1:
+                    tracks.append(track)
+            keys = dict([(track.name, len(track.times)) for track in tracks])
+            self.metrics.addAnimation(obj.name, len(frames), keys)
+            sampleCount += 3 * len(frames)
+            keyCount += sum(keys.values()) + 3 - len(tracks)
+            if tracks:
+                animations[obj.name] = tracks
+        if objects:
+            print("Animation: %i objects, %i of %i samples kept as keys" % (len(animations), keyCount, sampleCount))
+        return animations
+    
+    def writeAnimation(self, parent, obj, tracks):
+        data = self.doc.createDataElement("a_" + obj.name)
+        parent.appendChild(data)
+        for track in tracks:
+            valueElement = self.doc.createFloatElement(None, track.name + "Key")
+            self.setArray(valueElement, self.getFloatPayload(track.times), 'f')
+            data.appendChild(valueElement)
+            valueElement = getattr(self.doc, "createFloat%iElement" % track.size)(None, track.name)
+            self.setArray(valueElement, self.getFloatPayload(track.values), 'f')
+            data.appendChild(valueElement)
+    
+    def getFloatPayload(self, values):
+        if self.buffers:
+            return values
+        return formatFloats(values, self.floatDigits)
     
     def writeTransform(self, parent, obj):
         if obj.data.name.startswith('~tmp-mesh'):
@@ -341,10 +842,16 @@ class xml3d_exporter:
         axis = quat.axis
         angle =  quat.angle * DEG2RAD
         
+        tracks = self.animations.get(obj.name)
+        if tracks:
+            self.writeAnimation(parent, obj, tracks)
+        
         transform = self.doc.createTransformElement("t_" + obj.name)
-        transform.setTranslation("%.6f %.6f %.6f" % (obj.LocX, obj.LocY, obj.LocZ))
-        transform.setScale("%.6f %.6f %.6f" % (obj.SizeX, obj.SizeY, obj.SizeZ))
-        transform.setRotation("%.6f %.6f %.6f %.6f" % (axis.x, axis.y, axis.z, angle))
+        transform.setTranslation(self.formatValues(obj.LocX, obj.LocY, obj.LocZ))
+        transform.setScale(self.formatValues(obj.SizeX, obj.SizeY, obj.SizeZ))
+        transform.setRotation(self.formatValues(axis.x, axis.y, axis.z, angle))
+        if tracks:
+            transform.setAttribute("animation", "#a_" + obj.name)
         parent.appendChild(transform)
         
     def writePhysicsMaterial(self, parent, mesh):
@@ -364,56 +871,130 @@ class xml3d_exporter:
             # Set the friction
             frictionElement = self.doc.createElement("float")
             frictionElement.setAttribute("name", "friction")
-            frictionElement.appendChild(self.doc.createTextNode(str(materials[0].rbFriction)))
+            frictionElement.appendChild(self.doc.createTextNode(self.formatValues(materials[0].rbFriction)))
             mat.appendChild(frictionElement)
     
             # Set the restitution
             restitutionElement = self.doc.createElement("float")
             restitutionElement.setAttribute("name", "restitution")
-            restitutionElement.appendChild(self.doc.createTextNode(str(materials[0].rbRestitution)))
+            restitutionElement.appendChild(self.doc.createTextNode(self.formatValues(materials[0].rbRestitution)))
             mat.appendChild(restitutionElement)
 
         
         
-    def writeLightShader(self, parent, light):
+    def getLightParameters(self, light):
+        """ The (type, name, value) parameters of the light shader of a lamp,
+        None if the lamp type is not supported """
         # TODO: Spot Light, Directional Light
         # Blender LAMP type --> XML3D "urn:xml3d:lightshader:point"      
-        if ( light.type == Blender.Lamp.Types.Lamp ):                  
-            lightShaderElement = self.doc.createLightshaderElement("ls_" + light.name, "urn:xml3d:lightshader:point")
-            parent.appendChild(lightShaderElement)
-        
-            mode = light.mode
-            valueElement = self.doc.createBoolElement(None, "castShadow")
-            if mode & Blender.Lamp.Modes.RayShadow or mode & Blender.Lamp.Modes.Shadows:
-                valueElement.setValue("true")
-            else:
-                valueElement.setValue("false")
-            
-            lightShaderElement.appendChild(valueElement)
+        if ( light.type != Blender.Lamp.Types.Lamp ):
+            return None
+        parameters = []
         
+        mode = light.mode
+        if mode & Blender.Lamp.Modes.RayShadow or mode & Blender.Lamp.Modes.Shadows:
+            parameters.append(("bool", "castShadow", "true"))
+        else:
+            parameters.append(("bool", "castShadow", "false"))
+        
+        attens = [1.0, 0.0, 0.0]
+        if light.falloffType == Blender.Lamp.Falloffs.CONSTANT:
             attens = [1.0, 0.0, 0.0]
-            if light.falloffType == Blender.Lamp.Falloffs.CONSTANT:
-                attens = [1.0, 0.0, 0.0]
-            elif light.falloffType == Blender.Lamp.Falloffs.INVLINEAR:
-                attens = [1.0, 1.0 / light.dist, 0.0]
-            elif light.falloffType == Blender.Lamp.Falloffs.INVSQUARE:
-                attens = [1.0, 0.0, 1.0 / (light.dist * light.dist)]
-            
-            valueElement = self.doc.createFloat3Element(None, "attenuation")
-            valueElement.setValue("%f %f %f" % tuple(attens))
-            lightShaderElement.appendChild(valueElement)
+        elif light.falloffType == Blender.Lamp.Falloffs.INVLINEAR:
+            attens = [1.0, 1.0 / light.dist, 0.0]
+        elif light.falloffType == Blender.Lamp.Falloffs.INVSQUARE:
+            attens = [1.0, 0.0, 1.0 / (light.dist * light.dist)]
         
-            valueElement = self.doc.createFloat3Element(None, "intensity")
-            valueElement.setValue("%f %f %f" % (light.r, light.g, light.b))
-            lightShaderElement.appendChild(valueElement)
+        parameters.append(("float3", "attenuation", self.formatValues(*attens)))
+        parameters.append(("float3", "intensity", self.formatValues(light.r, light.g, light.b)))
+        return parameters
         
+    def writeShader(self, shaderElement, parameters):
+        """ Appends (type, name, value) parameters to a shader element """
+        doc = self.doc
+        for valueType, name, value in parameters:
+            if valueType == "texture":
+                # value holds the URL of the image and those of its mipmaps
+                texture = doc.createTextureElement(None, name)
+                if len(value) > 1:
+                    texture.setAttribute("mipmaps", " ".join(value[1:]))
+                texture.appendChild(doc.createImgElement(None, value[0]))
+                shaderElement.appendChild(texture)
+            else:
+                valueElement = getattr(doc, "create%sElement" % valueType.capitalize())(None, name)
+                valueElement.setValue(value)
+                shaderElement.appendChild(valueElement)
+    
+    def writeShaders(self, parent):
+        """ Writes the shaders of the materials and lamps used by the scene graph.
+        
+        Shaders with the same parameters are written once, shaderIds maps
+        the ids of the others to the one written.
+        """
+        self.shaderIds = {}
+        usedMaterials = self.getUsedMaterials()
+        usedLamps = {}
+        for obj in self.sceneObjects:
+            if obj.getType() == 'Lamp':
+                usedLamps[obj.getData(name_only=1)] = True
+        
+        written = {}
+        for lamp in bpy.data.lamps:
+            if lamp.name not in usedLamps:
+                continue
+            parameters = self.getLightParameters(lamp)
+            if parameters is None:
+                continue
+            key = ("urn:xml3d:lightshader:point",) + tuple(parameters)
+            if key not in written:
+                written[key] = "ls_" + lamp.name
+                shaderElement = self.doc.createLightshaderElement(written[key], key[0])
+                parent.appendChild(shaderElement)
+                self.writeShader(shaderElement, parameters)
+            self.shaderIds["ls_" + lamp.name] = written[key]
+        
+        for material in usedMaterials:
+            parameters = self.getPhongParameters(material)
+            key = ("urn:xml3d:shader:phong",) + tuple(parameters)
+            if key not in written:
+                written[key] = material.name
+                shaderElement = self.doc.createShaderElement(written[key], key[0])
+                parent.appendChild(shaderElement)
+                self.writeShader(shaderElement, parameters)
+            self.shaderIds[material.name] = written[key]
+        
+        print("Shaders: %i for %i materials and %i lamps in use" % (len(written), len(usedMaterials), len(usedLamps)))
+    
+    def collectSceneObjects(self):
+        """ The objects of the exported scene that are rendered. Meshes,
+        lamps, materials, textures and views are exported only if these refer
+        to them, other scenes and hidden helpers are skipped """
+        objects = []
+        for obj in self.scene.objects:
+            if obj.restrictRender or not obj.Layers & self.scene.Layers:
+                continue
+            objects.append(obj)
+        return objects
+    
+    def getUsedMaterials(self):
+        """ The materials of the exported mesh objects, in the order of bpy.data.materials """
+        names = {}
+        for obj in self.sceneObjects:
+            if obj.getType() == 'Mesh':
+                for material in obj.getData(mesh=True).materials:
+                    if material:
+                        names[material.name] = True
+        return [material for material in bpy.data.materials if material.name in names]
+    
+    def getShaderId(self, name):
+        return self.shaderIds.get(name, name)
         
-    def writeDefaultShader(self):
+    def writeDefaultShader(self, parent):
         if self.noMaterialAppeared:
             return
         self.noMaterialAppeared = True
-        defElement = self.doc.getElementById("mainDef")
         shaderElement = self.doc.createShaderElement("_no_mat", "urn:xml3d:shader:phong");
+        parent.appendChild(shaderElement)
 
         valueElement = self.doc.createFloat3Element(None, "diffuseColor")
         valueElement.setValue("0.3 0.3 0.3")
@@ -422,78 +1003,108 @@ class xml3d_exporter:
         valueElement = self.doc.createFloatElement(None, "ambientIntensity")
         valueElement.setValue("0.2")
         shaderElement.appendChild(valueElement)
-
-        defElement.appendChild(shaderElement)
                
         
-    def writePhongShader(self, parent, material):
-        doc = self.doc
-        shaderElement = doc.createShaderElement(material.name, "urn:xml3d:shader:phong");
-        parent.appendChild(shaderElement)
-        
-        world = Blender.World.GetCurrent()
-        
-        valueElement = doc.createFloatElement(None, "ambientIntensity")
-        if world:
-            ambR, ambG, ambB = world.amb;
-            valueElement.setValue(str(material.amb * ((ambR + ambG + ambB) / 3.0)))
-        else:
-            valueElement.setValue(str(material.amb))
-            
-        shaderElement.appendChild(valueElement)
-        
-        hasTexture = False
+    def getDiffuseImage(self, material):
+        """ The image of the first UV mapped color texture of material, or None """
         for mtex in material.textures:
             if mtex == None:
                 continue
             if mtex.texco == Blender.Texture.TexCo.UV and mtex.mapto == Blender.Texture.MapTo.COL:
                 if mtex.tex.type == Blender.Texture.Types.IMAGE:
-                    texture = doc.createTextureElement(None, "diffuseTexture")
-                    img = doc.createImgElement(None, Blender.sys.basename(mtex.tex.image.filename))
-                    texture.appendChild(img)
-                    shaderElement.appendChild(texture)
-                    hasTexture = True
-                    
-                    valueElement = doc.createFloat3Element(None, "diffuseColor")
-                    #fac = 1.0 - mtex.colfac
-                    #valueElement.setValue("%f %f %f" % (material.rgbCol[0] * fac, material.rgbCol[1] * fac, material.rgbCol[2] * fac))
-                    valueElement.setValue("1 1 1")
-                    shaderElement.appendChild(valueElement)
-                    break;
-            
-        if not hasTexture:
-            valueElement = doc.createFloat3Element(None, "diffuseColor")
-            valueElement.setValue("%f %f %f" % tuple(material.rgbCol))
-            shaderElement.appendChild(valueElement)
-
+                    return mtex.tex.image
+        return None
+    
+    def getTextureOptions(self):
+        options = TextureOptions()
+        options.maxSize = self.textureMaxSize
+        options.powerOfTwo = self.texturePowerOfTwo
+        options.format = self.textureFormat
+        options.quality = self.textureQuality
+        options.mipmaps = self.textureMipmaps
+        return options
+    
+    def processTextures(self):
+        """ Writes the images of all diffuse textures into textureDir and
+        remembers their new URLs in textureFiles, by image file name a tuple
+        of the texture's URL followed by those of its mipmaps """
+        self.textureFiles = {}
+        directory = os.path.join(os.path.dirname(os.path.abspath(self.filename)), self.textureDir)
+        options = self.getTextureOptions()
+        
+        # Images with the same content are processed once
+        names, keys, jobs = [], [], []
+        firstJobs = {}
+        for material in self.getUsedMaterials():
+            image = self.getDiffuseImage(material)
+            if not image or image.filename in names:
+                continue
+            source = Blender.sys.expandpath(image.filename)
+            if not os.path.isfile(source):
+                print("WARNING: Texture image %s not found, referring to it by name" % image.filename)
+                continue
+            key = textureHash(source, options)
+            names.append(image.filename)
+            keys.append(key)
+            if key not in firstJobs:
+                firstJobs[key] = len(jobs)
+                jobs.append((source, directory, key, options))
+        if not jobs:
+            return
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        
+        results = self.runJobs(processTexture, jobs)
+        for name, key in zip(names, keys):
+            result = results[firstJobs[key]]
+            self.textureFiles[name] = tuple([self.textureDir + "/" + filename
+                                             for filename in [result.filename] + result.mipmaps])
+        for job, result in zip(jobs, results):
+            self.metrics.addTexture(os.path.basename(job[0]), result.width, result.height,
+                                    result.bytes, result.cached, result.seconds)
+        print("Textures: %i images, %i files, %i unchanged" %
+              (len(names), len(results), len([r for r in results if r.cached])))
+    
+    def getPhongParameters(self, material):
+        """ The (type, name, value) parameters of the phong shader of a material """
+        parameters = []
+        
+        world = self.world
+        if world:
+            ambR, ambG, ambB = world.amb;
+            parameters.append(("float", "ambientIntensity", self.formatValues(material.amb * ((ambR + ambG + ambB) / 3.0))))
+        else:
+            parameters.append(("float", "ambientIntensity", self.formatValues(material.amb)))
+        
+        image = self.getDiffuseImage(material)
+        if image:
+            urls = self.textureFiles.get(image.filename, (Blender.sys.basename(image.filename),))
+            parameters.append(("texture", "diffuseTexture", urls))
+            #fac = 1.0 - mtex.colfac
+            #valueElement.setValue("%f %f %f" % (material.rgbCol[0] * fac, material.rgbCol[1] * fac, material.rgbCol[2] * fac))
+            parameters.append(("float3", "diffuseColor", "1 1 1"))
+        else:
+            parameters.append(("float3", "diffuseColor", self.formatValues(*material.rgbCol)))
         
         emit = material.getEmit()
         if emit > 0.0001:
-            valueElement = doc.createFloat3Element(None, "emissiveColor")
-            valueElement.setValue("%f %f %f" % (material.rgbCol[0] * emit, material.rgbCol[1] * emit, material.rgbCol[2] * emit))
-            shaderElement.appendChild(valueElement)
+            parameters.append(("float3", "emissiveColor",
+                               self.formatValues(material.rgbCol[0] * emit, material.rgbCol[1] * emit, material.rgbCol[2] * emit)))
         
-        valueElement = doc.createFloat3Element(None, "specularColor")
-        valueElement.setValue("%f %f %f" % 
-                          ((material.specCol[0] * material.spec),
+        parameters.append(("float3", "specularColor", self.formatValues(
+                           (material.specCol[0] * material.spec),
                            (material.specCol[1] * material.spec),
-                           (material.specCol[2] * material.spec)))
-        shaderElement.appendChild(valueElement)
+                           (material.specCol[2] * material.spec))))
         
-        valueElement = doc.createFloatElement(None, "shininess")
-        valueElement.setValue(str(material.hard/511.0))
-        shaderElement.appendChild(valueElement)
+        parameters.append(("float", "shininess", self.formatValues(material.hard / 511.0)))
         
         transparent = 1.0 - material.alpha;
         if (transparent > 0.0001):
-            valueElement = doc.createFloatElement(None, "transparency")
-            valueElement.setValue(str(transparent))
-            shaderElement.appendChild(valueElement)
+            parameters.append(("float", "transparency", self.formatValues(transparent)))
         
         if material.mode & Material.Modes.RAYMIRROR != 0:
-            valueElement = doc.createFloat3Element(None, "reflective")
-            valueElement.setValue("%f %f %f" % (material.rayMirr, material.rayMirr, material.rayMirr)) 
-            shaderElement.appendChild(valueElement)
+            parameters.append(("float3", "reflective", self.formatValues(material.rayMirr, material.rayMirr, material.rayMirr)))
+        return parameters
         
         
     def writeHeader(self):
@@ -539,89 +1150,167 @@ class xml3d_exporter:
         
         
         light = self.doc.createLightElement();
-        light.setShader("#ls_%s" % obj.getData(name_only=1))
+        light.setShader("#" + self.getShaderId("ls_%s" % obj.getData(name_only=1)))
         group.appendChild(light)
         
+    def writeBatch(self, batch, parent):
+        group = self.doc.createGroupElement()
+        parent.appendChild(group)
+        if batch.material:
+            group.setShader("#" + self.getShaderId(batch.material.name))
+        else:
+            group.setShader("#_no_mat")
+        
+        # Vertices are in world space already
+        if self.exportBounds:
+            self.writeBounds(group, self.meshBounds[batch.name])
+        chunks = self.meshChunks[batch.name]
+        for c, types in enumerate(chunks):
+            src = "#" + self.getDataName(batch.name, c, len(chunks))
+            group.appendChild(self.doc.createMeshElement(None, None, self.getMeshType(types, 0), src))
+    
     def writeSceneGraph(self, parent):
-        for obj in self.scene.objects:
+        for obj in self.sceneObjects:
             
-            if obj.restrictRender:
-                continue
-            
-            if (obj.getType() == 'Mesh'):
+            if (obj.getType() == 'Mesh') and obj.name not in self.batchedObjects:
                 self.writeMeshObject(obj, parent)
             if (obj.getType() == 'Lamp'):
                 self.writeLight(obj, parent)
+        for batch in self.batches:
+            self.writeBatch(batch, parent)
     
     def writeViews(self, parent):
         if not self.scene.objects.camera:
             view = self.doc.createViewElement("defaultView")
             parent.appendChild(view)
         else:
-            for obj in bpy.data.objects:
+            # The active camera is the active view, even if it is not rendered
+            cameras = [obj for obj in self.sceneObjects if obj.getType() == 'Camera']
+            if self.scene.objects.camera not in cameras:
+                cameras.append(self.scene.objects.camera)
+            for obj in cameras:
                 if (obj.getType() == 'Camera'):
                     view = self.doc.createViewElement(obj.name);
-                    view.setPosition("%.6f %.6f %.6f" % (obj.LocX, obj.LocY, obj.LocZ))
+                    view.setPosition(self.formatValues(obj.LocX, obj.LocY, obj.LocZ))
                     quat = obj.mat.rotationPart().toQuat()
                     rot = quat.axis
-                    view.setOrientation("%.6f %.6f %.6f %.6f" % (rot[0], rot[1], rot[2], quat.angle * DEG2RAD))
+                    view.setOrientation(self.formatValues(rot[0], rot[1], rot[2], quat.angle * DEG2RAD))
                     parent.appendChild(view)
       
    
         
+    def getCompressions(self):
+        """ The (method, level) list for OutputFile, raises if a method is not available """
+        levels = { "gzip": self.gzipLevel, "brotli": self.brotliLevel }
+        compressions = [(method, levels.get(method)) for method in self.outputCompression]
+        checkCompressions(compressions)
+        return compressions
+    
     def write(self, scene):
       
-        self.doc = XML3DDocument();
         self.scene = scene
         renderData = scene.getRenderingContext()
 
       
         print('--> START: Exporting XML3D to %s' % self.filename)
         start_time = Blender.sys.time()
+        # Compressions are checked before any file is created
         try:
-            out = open(self.filename, 'w')
+            compressions = self.getCompressions()
+        except (ValueError, ImportError):
+            print('ERROR: %s' % sys.exc_info()[1])
+            return False
+        try:
+            out = OutputFile(self.filename, compressions, self.keepUncompressed)
         except:
-            print('ERROR: Could not open %s' % self.filename)
+            print('ERROR: Could not open %s: %s' % (self.filename, sys.exc_info()[1]))
             return False
       
-      
-        parent = self.writeHeader()
+        # Every finished subtree is written to out right away, thus the
+        # document never holds the complete scene in memory
+        self.doc = XML3DStreamDocument(out, " ", " ", "\n", "UTF-8")
+        self.buffers = None
+        self.poolFailed = False
+        
+        # A failed export closes its files too, thus no compressor thread
+        # stays blocked, and removes them instead of leaving truncated ones
+        finished = False
+        try:
+            if self.binaryBuffers:
+                self.buffers = BinaryBufferFile(os.path.splitext(self.filename)[0] + ".bin")
+            if self.meshCacheDir:
+                self.meshCache = MeshCache(self.meshCacheDir, self.meshCacheSize)
+            self.metrics = ExportMetrics(self.traceMemory)
+            
+            self.metrics.begin("header")
+            parent = self.writeHeader()
     
-        world = scene.world
+            world = scene.world
         
-        view = "#defaultView"
-        if scene.objects.camera:
-            view = "#"+scene.objects.camera.name
+            view = "#defaultView"
+            if scene.objects.camera:
+                view = "#"+scene.objects.camera.name
         
-        xml3dElem = self.doc.createXml3dElement(activeView_ = view)
-        xml3dElem.setAttribute("xmlns", "http://www.xml3d.org/2009/xml3d")
-        if self.annotatePhysics:
-            xml3dElem.setAttribute("xmlns:physics", "http://www.xml3d.org/2010/physics")
-            if world:
-                xml3dElem.setAttribute("physics:gravity", "0 %.6f 0" % (-world.gravity))
+            xml3dElem = self.doc.createXml3dElement(activeView_ = view)
+            xml3dElem.setAttribute("xmlns", "http://www.xml3d.org/2009/xml3d")
+            if self.annotatePhysics:
+                xml3dElem.setAttribute("xmlns:physics", "http://www.xml3d.org/2010/physics")
+                if world:
+                    xml3dElem.setAttribute("physics:gravity", "0 %.6f 0" % (-world.gravity))
         
         
-        style = "width: %ipx; height: %ipx;" % (renderData.sizeX, renderData.sizeY)
-        if world:
-            bgColor = world.getHor()
-            style += " background-color:rgb(%i,%i,%i);" % (bgColor[0] * 255, bgColor[1] * 255, bgColor[2] * 255)
+            style = "width: %ipx; height: %ipx;" % (renderData.sizeX, renderData.sizeY)
+            if world:
+                bgColor = world.getHor()
+                style += " background-color:rgb(%i,%i,%i);" % (bgColor[0] * 255, bgColor[1] * 255, bgColor[2] * 255)
         
         
-        xml3dElem.setAttribute("style", style)
+            xml3dElem.setAttribute("style", style)
     
-        parent.appendChild(xml3dElem)
+            parent.appendChild(xml3dElem)
+            self.metrics.end("header")
       
-        self.writeMainDef(xml3dElem)
+            self.metrics.begin("mainDef")
+            try:
+                self.writeMainDef(xml3dElem)
+            finally:
+                # All meshes are extracted by now, free the pooled container
+                self.releaseContainerMesh()
+            self.metrics.end("mainDef")
       
-        self.writeViews(xml3dElem)
+            self.metrics.begin("views")
+            self.writeViews(xml3dElem)
+            self.metrics.end("views")
       
-        self.writeSceneGraph(xml3dElem)
+            self.metrics.begin("scene graph")
+            self.writeSceneGraph(xml3dElem)
+            self.metrics.end("scene graph")
            
-        self.writeScripts(parent)
-    
-        self.doc.writexml(out, " ", " ", "\n", "UTF-8")
+            self.writeScripts(parent)
     
-        out.close()
+            self.metrics.begin("serialization")
+            self.doc.close()
+            finished = True
+        finally:
+            self.closePool(not finished)
+            # Waits for the compressor threads
+            out.close(not finished)
+            if self.buffers:
+                self.buffers.close()
+                if not finished:
+                    os.remove(self.buffers.filename)
+                    self.buffers = None
+        self.metrics.end("serialization")
+        
+        outputFiles = [(name, os.path.getsize(name)) for name in out.filenames]
+        if self.buffers:
+            outputFiles.append((self.buffers.filename, self.buffers.offset))
+            self.buffers = None
+        if self.metricsReport:
+            self.metrics.writeReport(os.path.splitext(self.filename)[0] + "-metrics.json", outputFiles)
+        if self.meshCache:
+            print("Mesh cache: %i hits, %i misses" % (self.meshCache.hits, self.meshCache.misses))
+            self.meshCache = None
         print('--> END: Exporting XML3D. Duration: %.2f' % (Blender.sys.time() - start_time))
         return
 
@@ -0,0 +1,1521 @@
+# --------------------------------------------------------------------------
+# XML3D exporter: mesh processing
+# --------------------------------------------------------------------------
+# ***** BEGIN GPL LICENSE BLOCK *****
+#
+# Copyright (C) 2010: DFKI GmbH, kristian.sons@dfki.de
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+#
+# ***** END GPL LICENCE BLOCK *****
+# --------------------------------------------------------------------------
+#
+# Works on flat copies of the mesh geometry only, thus nothing in here
+# depends on the Blender API.
+
+from xml3d_encode import formatFloats, formatInts, digitsForExtent
+import array
+import collections
+import hashlib
+import marshal
+import math
+import os
+import sys
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Part of every cache key, change whenever encodeMesh produces different output
+ENCODING_VERSION = 8
+
+
+class MeshArrays:
+    """ Flat copies of the geometry of a Blender mesh """
+
+    def __init__(self):
+        self.positions = []      # x y z per vertex
+        self.vertexNormals = []  # x y z per vertex
+        self.faceSizes = []      # number of corners per face
+        self.corners = []        # vertex index per face corner
+        self.faceNormals = []    # x y z per face
+        self.faceSmooth = []     # smooth flag per face
+        self.faceMaterials = []  # material index per face
+        self.uvs = None          # u v per face corner, None without UVs
+        self.materialCount = 1
+
+
+class VertexBuffers:
+    """ Deduplicated vertex attributes and one index list per material """
+
+    def __init__(self, positions, normals, texcoords, indices):
+        self.positions = positions  # x y z per vertex
+        self.normals = normals      # x y z per vertex
+        self.texcoords = texcoords  # u v per vertex, None without UVs
+        self.indices = indices      # list of vertex indices per material
+
+    def vertexCount(self):
+        return len(self.positions) // 3
+
+
+class MeshOptions:
+    """ Export options that influence the encoded mesh data """
+
+    def __init__(self):
+        self.binary = False
+        self.positionTolerance = 1e-5
+        self.normalDigits = 4
+        self.texcoordDigits = 5
+        self.vertexCacheSize = 0
+        self.triangleStrips = False
+        self.lodRatios = ()
+        self.maxChunkVertices = 0
+        self.quantize = False
+        self.autoSmoothAngle = 0.0
+
+
+class EncodedChunk:
+    """ Encoded attributes and indices of a part of a mesh, ready for its data elements
+
+    Payloads are text, or flat value lists if they go to a binary buffer.
+    """
+
+    def __init__(self, vertexCount):
+        self.vertexCount = vertexCount
+        self.attributes = []  # (element, name, typecode, payload)
+        self.indices = []     # payload per material
+        self.types = []       # mesh type per material, triangles or tristrips
+        self.acmr = None      # (before, after) of the vertex cache optimization
+        self.lods = []        # (ratio, triangles, error, relative error, payload per material)
+        self.bounds = None    # (box minimum, box maximum, sphere center, sphere radius)
+        self.quantizationErrors = None  # maximum error by attribute, degrees for normals
+
+
+class EncodedMesh:
+    """ The encoded chunks of a mesh. There is a single chunk unless the
+    mesh has more vertices than fit into one """
+
+    def __init__(self, faceCount, triangleCount, cornerCount, vertexCount):
+        self.faceCount = faceCount          # polygons of the source mesh
+        self.triangleCount = triangleCount
+        self.cornerCount = cornerCount      # of the triangles
+        self.vertexCount = vertexCount  # of all chunks together
+        self.chunks = []      # EncodedChunk
+        self.times = {}       # seconds per processing phase
+        self.acmr = None      # (before, after) of the vertex cache optimization
+        self.bounds = None    # (box minimum, box maximum, sphere center, sphere radius)
+
+
+class MeshCache:
+    """ Encoded meshes stored on disk by content hash
+
+    Every entry is an EncodedMesh in its own file, a header line followed by
+    its attributes as marshal data. Entries hold plain values only, thus
+    loading them never creates other objects or runs code, and files with a
+    different header are ignored. Still, marshal does not guard against
+    malicious data, the directory should not be writable by other users.
+    The modification time of a file is its last use, evict removes the least
+    recently used entries until the cache fits into maxSize bytes.
+    """
+
+    # Marshal data differs between Python 2 and 3
+    HEADER = ("XML3DMESH %i %i\n" % (ENCODING_VERSION, sys.version_info[0])).encode('ascii')
+
+    def __init__(self, directory, maxSize):
+        self.directory = directory
+        self.maxSize = maxSize
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".mesh")
+
+    def get(self, key):
+        """ Returns the EncodedMesh stored for key or None """
+        path = self._path(key)
+        try:
+            f = open(path, 'rb')
+            try:
+                if f.readline() != self.HEADER:
+                    raise ValueError("Not a mesh cache entry: " + path)
+                encoded = _loadEncodedMesh(marshal.loads(f.read()))
+            finally:
+                f.close()
+            os.utime(path, None)
+        except Exception:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return encoded
+
+    def put(self, key, encoded):
+        path = self._path(key)
+        temp = "%s.%i.tmp" % (path, os.getpid())
+        f = open(temp, 'wb')
+        try:
+            f.write(self.HEADER)
+            f.write(marshal.dumps(_plainValue(vars(encoded)), 2))
+        finally:
+            f.close()
+        try:
+            os.rename(temp, path)
+        except OSError:
+            # Windows does not replace existing files
+            os.remove(temp)
+
+    def evict(self):
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith(".mesh"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self.maxSize:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+
+_PLAIN_TYPES = set([type(None), bool, int, float, str, type(u""), type(b"")])
+if sys.version_info[0] < 3:
+    _PLAIN_TYPES.add(long)
+
+
+def _plainValue(value):
+    # value with objects turned into dicts of their attributes and number
+    # subclasses, like the numpy scalars, into the built-in types, thus
+    # marshal can write it
+    if isinstance(value, (list, tuple)):
+        if not set(map(type, value)) <= _PLAIN_TYPES:
+            value = [_plainValue(v) for v in value]
+        return list(value)
+    if isinstance(value, dict):
+        return dict([(k, _plainValue(v)) for k, v in value.items()])
+    if type(value) in _PLAIN_TYPES:
+        return value
+    if isinstance(value, float):
+        return float(value)
+    if isinstance(value, (int, bool)) or hasattr(value, '__index__'):
+        return int(value)
+    if hasattr(value, '__dict__'):
+        return _plainValue(vars(value))
+    return float(value)
+
+
+def _loadEncodedMesh(data):
+    # Inverse of _plainValue for an EncodedMesh. Payloads stay lists, the
+    # writers accept them like tuples
+    encoded = EncodedMesh(data["faceCount"], data["triangleCount"], data["cornerCount"], data["vertexCount"])
+    encoded.times = data["times"]
+    encoded.acmr = data["acmr"] and tuple(data["acmr"])
+    encoded.bounds = data["bounds"]
+    for values in data["chunks"]:
+        chunk = EncodedChunk(values["vertexCount"])
+        chunk.attributes = [tuple(attribute) for attribute in values["attributes"]]
+        chunk.indices = values["indices"]
+        chunk.types = values["types"]
+        chunk.acmr = values["acmr"] and tuple(values["acmr"])
+        chunk.lods = [tuple(lod) for lod in values["lods"]]
+        chunk.bounds = values["bounds"]
+        chunk.quantizationErrors = values["quantizationErrors"]
+        encoded.chunks.append(chunk)
+    return encoded
+
+
+def _toBytes(values, typecode):
+    data = array.array(typecode, values)
+    if hasattr(data, 'tobytes'):
+        return data.tobytes()
+    return data.tostring()
+
+
+def meshHash(arrays, options):
+    """ Content hash of the mesh arrays and the options that affect their encoding """
+    digest = hashlib.sha1()
+    for values, typecode in ((arrays.positions, 'd'), (arrays.vertexNormals, 'd'),
+                             (arrays.faceSizes, 'i'), (arrays.corners, 'i'),
+                             (arrays.faceNormals, 'd'), (arrays.faceSmooth, 'b'),
+                             (arrays.faceMaterials, 'i'), (arrays.uvs or [], 'd')):
+        digest.update(_toBytes(values, typecode))
+        digest.update(b'|')
+    settings = sorted(vars(options).items())
+    digest.update(repr((ENCODING_VERSION, arrays.uvs is None, arrays.materialCount, settings)).encode('ascii'))
+    return digest.hexdigest()
+
+
+def boundingBox(positions):
+    """ Returns the minimum and maximum corner of a flat x y z array """
+    if numpy:
+        points = numpy.asarray(positions, dtype=numpy.float64).reshape(-1, 3)
+        if not len(points):
+            return [0.0] * 3, [0.0] * 3
+        return points.min(axis=0).tolist(), points.max(axis=0).tolist()
+    if not len(positions):
+        return [0.0] * 3, [0.0] * 3
+    lower, upper = [], []
+    for axis in range(3):
+        coords = positions[axis::3]
+        lower.append(min(coords))
+        upper.append(max(coords))
+    return lower, upper
+
+
+def boundingVolumes(positions):
+    """ Returns the axis aligned box and a bounding sphere of a flat x y z array
+    as (minimum, maximum, center, radius). The sphere is centered in the box """
+    lower, upper = boundingBox(positions)
+    center = [(lower[i] + upper[i]) * 0.5 for i in range(3)]
+    if not len(positions):
+        return lower, upper, center, 0.0
+    if numpy:
+        points = numpy.asarray(positions, dtype=numpy.float64).reshape(-1, 3)
+        radius = float(numpy.sqrt(((points - center) ** 2).sum(axis=1).max()))
+    else:
+        cx, cy, cz = center
+        radius = 0.0
+        for v in range(0, len(positions), 3):
+            dx, dy, dz = positions[v] - cx, positions[v + 1] - cy, positions[v + 2] - cz
+            radius = max(radius, dx * dx + dy * dy + dz * dz)
+        radius = radius ** 0.5
+    return lower, upper, center, radius
+
+
+def _earClip(points):
+    """ Triangulates a simple polygon given as list of (x, y), returns index triples """
+    count = len(points)
+    area = 0.0
+    for i in range(count):
+        x0, y0 = points[i - 1]
+        x1, y1 = points[i]
+        area += x0 * y1 - x1 * y0
+    # Counter-clockwise polygons have a positive area
+    orientation = 1.0
+    if area < 0.0:
+        orientation = -1.0
+
+    def cross(a, b, c):
+        return orientation * ((b[0] - a[0]) * (c[1] - a[1]) - (b[1] - a[1]) * (c[0] - a[0]))
+
+    remaining = list(range(count))
+    triangles = []
+    while len(remaining) > 3:
+        for k in range(len(remaining)):
+            i0, i1, i2 = remaining[k - 1], remaining[k], remaining[(k + 1) % len(remaining)]
+            a, b, c = points[i0], points[i1], points[i2]
+            if cross(a, b, c) <= 0.0:
+                continue
+            for j in remaining:
+                if j in (i0, i1, i2):
+                    continue
+                p = points[j]
+                if cross(a, b, p) >= 0.0 and cross(b, c, p) >= 0.0 and cross(c, a, p) >= 0.0:
+                    break
+            else:
+                triangles.append((i0, i1, i2))
+                del remaining[k]
+                break
+        else:
+            # No ear found, the polygon is degenerate. Fan the rest
+            break
+    for k in range(1, len(remaining) - 1):
+        triangles.append((remaining[0], remaining[k], remaining[k + 1]))
+    return triangles
+
+
+def _polygonTriangles(arrays, face, start, size):
+    """ Corner offsets of the triangles of a face with more than three corners """
+    positions = arrays.positions
+    co = []
+    for c in range(start, start + size):
+        v = 3 * arrays.corners[c]
+        co.append(positions[v:v + 3])
+
+    if size == 4:
+        # Split along the shorter diagonal, like Blender's quadToTriangle(0)
+        d02 = sum([(co[0][k] - co[2][k]) ** 2 for k in range(3)])
+        d13 = sum([(co[1][k] - co[3][k]) ** 2 for k in range(3)])
+        if d02 <= d13:
+            return ((0, 1, 2), (0, 2, 3))
+        return ((0, 1, 3), (1, 2, 3))
+
+    # Ear clipping in the plane of the face, dropping the dominant axis of its normal
+    normal = [abs(n) for n in arrays.faceNormals[3 * face:3 * face + 3]]
+    axis = normal.index(max(normal))
+    u, v = [(1, 2), (0, 2), (0, 1)][axis]
+    return _earClip([(p[u], p[v]) for p in co])
+
+
+def triangulate(arrays):
+    """ Returns arrays with every face split into triangles. Faces keep their order """
+    if not [size for size in arrays.faceSizes if size != 3]:
+        return arrays
+    if numpy:
+        cornerMap, faceMap = _triangleMapNumpy(arrays)
+    else:
+        cornerMap, faceMap = _triangleMapPython(arrays)
+
+    result = MeshArrays()
+    result.positions = arrays.positions
+    result.vertexNormals = arrays.vertexNormals
+    result.materialCount = arrays.materialCount
+    result.faceSizes = [3] * len(faceMap)
+    result.corners = [arrays.corners[c] for c in cornerMap]
+    result.faceSmooth = [arrays.faceSmooth[f] for f in faceMap]
+    result.faceMaterials = [arrays.faceMaterials[f] for f in faceMap]
+    faceNormals = arrays.faceNormals
+    for f in faceMap:
+        result.faceNormals.extend(faceNormals[3 * f:3 * f + 3])
+    if arrays.uvs is not None:
+        uvs = arrays.uvs
+        result.uvs = []
+        for c in cornerMap:
+            result.uvs.extend(uvs[2 * c:2 * c + 2])
+    return result
+
+
+def _triangleMapPython(arrays):
+    # Old corner of every new corner, old face of every new face
+    cornerMap, faceMap = [], []
+    start = 0
+    for face, size in enumerate(arrays.faceSizes):
+        if size == 3:
+            cornerMap.extend((start, start + 1, start + 2))
+            faceMap.append(face)
+        else:
+            for triangle in _polygonTriangles(arrays, face, start, size):
+                cornerMap.extend([start + k for k in triangle])
+                faceMap.append(face)
+        start += size
+    return cornerMap, faceMap
+
+
+def _triangleMapNumpy(arrays):
+    sizes = numpy.asarray(arrays.faceSizes, dtype=numpy.int64)
+    starts = numpy.concatenate(([0], numpy.cumsum(sizes)[:-1]))
+    triangleCounts = sizes - 2
+    faceMap = numpy.repeat(numpy.arange(len(sizes)), triangleCounts)
+    # Which triangle of its face every new face is
+    firsts = numpy.concatenate(([0], numpy.cumsum(triangleCounts)[:-1]))
+    nth = numpy.arange(len(faceMap)) - numpy.repeat(firsts, triangleCounts)
+    local = numpy.tile(numpy.array([0, 1, 2], dtype=numpy.int64), (len(faceMap), 1))
+
+    quads = numpy.nonzero(sizes == 4)[0]
+    if len(quads):
+        positions = numpy.asarray(arrays.positions, dtype=numpy.float64).reshape(-1, 3)
+        corners = numpy.asarray(arrays.corners, dtype=numpy.int64)
+        co = positions[corners[starts[quads][:, None] + numpy.arange(4)]]
+        d02 = ((co[:, 0] - co[:, 2]) ** 2).sum(axis=1)
+        d13 = ((co[:, 1] - co[:, 3]) ** 2).sum(axis=1)
+        # Both triangles of every quad
+        splits = numpy.array([[[0, 1, 2], [0, 2, 3]], [[0, 1, 3], [1, 2, 3]]], dtype=numpy.int64)
+        rows = numpy.repeat(firsts[quads], 2) + numpy.tile([0, 1], len(quads))
+        local[rows] = splits[numpy.repeat((d02 > d13).astype(numpy.int64), 2), numpy.tile([0, 1], len(quads))]
+
+    for face in numpy.nonzero(sizes > 4)[0].tolist():
+        triangles = _polygonTriangles(arrays, face, int(starts[face]), int(sizes[face]))
+        local[firsts[face]:firsts[face] + len(triangles)] = triangles
+
+    cornerMap = (starts[faceMap][:, None] + local).ravel()
+    return cornerMap.tolist(), faceMap.tolist()
+
+
+def _normalized(values):
+    result = []
+    for v in range(0, len(values), 3):
+        x, y, z = values[v:v + 3]
+        length = (x * x + y * y + z * z) ** 0.5
+        if length > 0.0:
+            x, y, z = x / length, y / length, z / length
+        result.extend((x, y, z))
+    return result
+
+
+def transformArrays(arrays, matrix):
+    """ Returns a copy of arrays in the space of matrix, three rows of
+    (x, y, z, translation). Normals are transformed by the inverse transpose
+    and normalized, faces are reversed if matrix mirrors so they keep facing
+    outwards. Faces are triangulated before, thus they are split like in
+    object space """
+    arrays = triangulate(arrays)
+    m = [row[:3] for row in matrix]
+    # Cofactors are the inverse transpose times the determinant
+    cofactors = [[m[(i + 1) % 3][(j + 1) % 3] * m[(i + 2) % 3][(j + 2) % 3] -
+                  m[(i + 1) % 3][(j + 2) % 3] * m[(i + 2) % 3][(j + 1) % 3] for j in range(3)] for i in range(3)]
+    determinant = sum([m[0][j] * cofactors[0][j] for j in range(3)])
+    if determinant < 0.0:
+        cofactors = [[-value for value in row] for row in cofactors]
+
+    result = MeshArrays()
+    result.materialCount = arrays.materialCount
+    result.faceSmooth = arrays.faceSmooth
+    result.faceMaterials = arrays.faceMaterials
+    result.faceSizes = arrays.faceSizes
+    if numpy:
+        linear = numpy.array(m, dtype=numpy.float64)
+        normalMatrix = numpy.array(cofactors, dtype=numpy.float64)
+        translation = numpy.array([row[3] for row in matrix], dtype=numpy.float64)
+        def apply(values, target, offset):
+            points = numpy.asarray(values, dtype=numpy.float64).reshape(-1, 3).dot(target.T)
+            if offset is None:
+                lengths = numpy.sqrt((points ** 2).sum(axis=1))
+                lengths[lengths == 0.0] = 1.0
+                points /= lengths[:, None]
+            else:
+                points += offset
+            return points.ravel().tolist()
+        result.positions = apply(arrays.positions, linear, translation)
+        result.vertexNormals = apply(arrays.vertexNormals, normalMatrix, None)
+        result.faceNormals = apply(arrays.faceNormals, normalMatrix, None)
+    else:
+        def apply(values, target, offset):
+            transformed = []
+            for v in range(0, len(values), 3):
+                x, y, z = values[v:v + 3]
+                for row, t in zip(target, offset):
+                    transformed.append(row[0] * x + row[1] * y + row[2] * z + t)
+            return transformed
+        result.positions = apply(arrays.positions, m, [row[3] for row in matrix])
+        result.vertexNormals = _normalized(apply(arrays.vertexNormals, cofactors, (0.0, 0.0, 0.0)))
+        result.faceNormals = _normalized(apply(arrays.faceNormals, cofactors, (0.0, 0.0, 0.0)))
+
+    if determinant >= 0.0:
+        result.corners = arrays.corners
+        result.uvs = arrays.uvs
+        return result
+    result.corners = []
+    if arrays.uvs is not None:
+        result.uvs = []
+    start = 0
+    for size in arrays.faceSizes:
+        reverse = range(start + size - 1, start - 1, -1)
+        result.corners.extend([arrays.corners[c] for c in reverse])
+        if arrays.uvs is not None:
+            for c in reverse:
+                result.uvs.extend(arrays.uvs[2 * c:2 * c + 2])
+        start += size
+    return result
+
+
+def mergeArrays(parts):
+    """ Concatenates the faces of one material of several meshes into arrays
+    with a single material. parts is a list of (arrays, material index).
+
+    If some of the meshes have UVs, the others get (0, 0) at every corner.
+    Only the vertices of the merged faces are copied, each of them once,
+    even if several parts come from the same arrays.
+    """
+    result = MeshArrays()
+    withUVs = [arrays for arrays, material in parts if arrays.uvs is not None]
+    if withUVs:
+        result.uvs = []
+    remaps = {}
+    for arrays, material in parts:
+        # New index by vertex index of arrays
+        remap = remaps.setdefault(id(arrays), {})
+        start = 0
+        for f, size in enumerate(arrays.faceSizes):
+            if arrays.faceMaterials[f] == material:
+                result.faceSizes.append(size)
+                for v in arrays.corners[start:start + size]:
+                    index = remap.get(v)
+                    if index is None:
+                        index = remap[v] = len(result.positions) // 3
+                        result.positions.extend(arrays.positions[3 * v:3 * v + 3])
+                        result.vertexNormals.extend(arrays.vertexNormals[3 * v:3 * v + 3])
+                    result.corners.append(index)
+                result.faceNormals.extend(arrays.faceNormals[3 * f:3 * f + 3])
+                result.faceSmooth.append(arrays.faceSmooth[f])
+                if arrays.uvs is not None:
+                    result.uvs.extend(arrays.uvs[2 * start:2 * (start + size)])
+                elif withUVs:
+                    result.uvs.extend([0.0] * (2 * size))
+            start += size
+    result.faceMaterials = [0] * len(result.faceSizes)
+    return result
+
+
+def appendUnique(mlist, value):
+    """ Returns the index of value in mlist and whether it was added """
+    count = len(mlist)
+    index = mlist.setdefault(value, count)
+    return index, index == count
+
+
+def weldNormals(arrays, angle):
+    """ Normals of the corners of flat faces, averaged over the flat faces
+    around the corner's vertex whose normals differ by at most angle degrees
+    from the corner's face. Faces are weighted by their angle at the vertex,
+    thus triangulation does not change the result. Returns x y z per corner.
+
+    Faces in a nearly planar region get the same normals at shared
+    vertices, thus dedupVertices merges their corners.
+    """
+    cosLimit = math.cos(math.radians(angle)) - 1e-12
+    if numpy:
+        return _weldNormalsNumpy(arrays, cosLimit)
+    return _weldNormalsPython(arrays, cosLimit)
+
+
+def _cornerAngle(positions, a, b, c):
+    # Angle at b between the edges to a and c
+    e1 = [positions[3 * a + k] - positions[3 * b + k] for k in range(3)]
+    e2 = [positions[3 * c + k] - positions[3 * b + k] for k in range(3)]
+    cross = (e1[1] * e2[2] - e1[2] * e2[1], e1[2] * e2[0] - e1[0] * e2[2], e1[0] * e2[1] - e1[1] * e2[0])
+    return math.atan2(sum([x * x for x in cross]) ** 0.5, sum([x * y for x, y in zip(e1, e2)]))
+
+
+def _weldNormalsPython(arrays, cosLimit):
+    corners, faceNormals = arrays.corners, arrays.faceNormals
+    cornerFaces = []
+    facesAt = {}
+    for f, size in enumerate(arrays.faceSizes):
+        start = len(cornerFaces)
+        for c in range(start, start + size):
+            cornerFaces.append(f)
+            if not arrays.faceSmooth[f]:
+                previous, following = start + (c - start - 1) % size, start + (c - start + 1) % size
+                weight = _cornerAngle(arrays.positions, corners[previous], corners[c], corners[following])
+                facesAt.setdefault(corners[c], []).append((f, weight))
+
+    normals = []
+    for c, f in enumerate(cornerFaces):
+        nx, ny, nz = faceNormals[3 * f:3 * f + 3]
+        if arrays.faceSmooth[f]:
+            normals.extend((nx, ny, nz))
+            continue
+        sx = sy = sz = 0.0
+        for g, weight in facesAt[corners[c]]:
+            gx, gy, gz = faceNormals[3 * g:3 * g + 3]
+            if nx * gx + ny * gy + nz * gz >= cosLimit:
+                sx, sy, sz = sx + gx * weight, sy + gy * weight, sz + gz * weight
+        length = (sx * sx + sy * sy + sz * sz) ** 0.5
+        if length > 0.0:
+            sx, sy, sz = sx / length, sy / length, sz / length
+        normals.extend((sx, sy, sz))
+    return normals
+
+
+def _weldNormalsNumpy(arrays, cosLimit):
+    corners = numpy.asarray(arrays.corners, dtype=numpy.int64)
+    cornerFace = numpy.repeat(numpy.arange(len(arrays.faceSizes)), arrays.faceSizes)
+    faceNormals = numpy.asarray(arrays.faceNormals, dtype=numpy.float64).reshape(-1, 3)
+    normals = faceNormals[cornerFace]
+    flat = numpy.nonzero(~numpy.asarray(arrays.faceSmooth, dtype=bool)[cornerFace])[0]
+    if not len(flat):
+        return normals.ravel().tolist()
+
+    sizes = numpy.asarray(arrays.faceSizes, dtype=numpy.int64)[cornerFace]
+    starts = numpy.repeat(numpy.cumsum(arrays.faceSizes) - arrays.faceSizes, arrays.faceSizes)
+    local = numpy.arange(len(corners)) - starts
+    positions = numpy.asarray(arrays.positions, dtype=numpy.float64).reshape(-1, 3)
+    e1 = positions[corners[starts + (local - 1) % sizes]] - positions[corners]
+    e2 = positions[corners[starts + (local + 1) % sizes]] - positions[corners]
+    weights = numpy.arctan2(numpy.sqrt((numpy.cross(e1, e2) ** 2).sum(axis=1)), (e1 * e2).sum(axis=1))
+
+    # Flat corners sorted by vertex, each paired with all corners of its vertex
+    order = flat[numpy.argsort(corners[flat], kind='mergesort')]
+    unused, groupStarts, counts = numpy.unique(corners[order], return_index=True, return_counts=True)
+    group = numpy.repeat(numpy.arange(len(counts)), counts)
+    pairCounts = counts[group]
+    first = numpy.repeat(numpy.arange(len(order)), pairCounts)
+    offsets = numpy.arange(len(first)) - numpy.repeat(numpy.cumsum(pairCounts) - pairCounts, pairCounts)
+    second = groupStarts[group][first] + offsets
+
+    own = faceNormals[cornerFace[order[first]]]
+    other = faceNormals[cornerFace[order[second]]]
+    close = (own * other).sum(axis=1) >= cosLimit
+    other = other[close] * weights[order[second[close]]][:, None]
+    welded = numpy.empty((len(order), 3))
+    for axis in range(3):
+        welded[:, axis] = numpy.bincount(first[close], weights=other[:, axis], minlength=len(order))
+    lengths = numpy.sqrt((welded ** 2).sum(axis=1))
+    welded /= numpy.where(lengths > 0.0, lengths, 1.0)[:, None]
+    normals[order] = welded
+    return normals.ravel().tolist()
+
+
+def dedupVertices(arrays, cornerNormals=None):
+    """ Creates one vertex per unique (index, normal, uv) tuple of the face corners.
+
+    Flat faces use the face normal, or cornerNormals if given, smooth faces
+    the vertex normal. Vertices are numbered in the order they are first
+    used, like the original export.
+    """
+    if numpy:
+        return _dedupVerticesNumpy(arrays, cornerNormals)
+    return _dedupVerticesPython(arrays, cornerNormals)
+
+
+def _dedupVerticesPython(arrays, cornerNormals):
+    # Keys are plain tuples (index, normal, u, v) of rounded values, thus the
+    # hash covers all of them and corners sharing a vertex do not collide.
+    # The normal is None for smooth faces and shared by all corners of a
+    # face, unless there are cornerNormals.
+    vertexDict = {}
+    keys = []
+    indices = [[] for m in range(arrays.materialCount)] #@UnusedVariable
+    corners, uvs, faceNormals = arrays.corners, arrays.uvs, arrays.faceNormals
+
+    start = 0
+    for f, size in enumerate(arrays.faceSizes):
+        normal = None
+        if not arrays.faceSmooth[f]:
+            normal = (round(faceNormals[3 * f], 8) + 0.0,
+                      round(faceNormals[3 * f + 1], 8) + 0.0,
+                      round(faceNormals[3 * f + 2], 8) + 0.0)
+        target = indices[arrays.faceMaterials[f]]
+        for c in range(start, start + size):
+            if normal is not None and cornerNormals is not None:
+                normal = (round(cornerNormals[3 * c], 8) + 0.0,
+                          round(cornerNormals[3 * c + 1], 8) + 0.0,
+                          round(cornerNormals[3 * c + 2], 8) + 0.0)
+            if uvs is None:
+                key = (corners[c], normal)
+            else:
+                key = (corners[c], normal, round(uvs[2 * c], 8) + 0.0, round(uvs[2 * c + 1], 8) + 0.0)
+            index, added = appendUnique(vertexDict, key)
+            if added:
+                keys.append(key)
+            target.append(index)
+        start += size
+
+    positions, normals, texcoords = [], [], None
+    if uvs is not None:
+        texcoords = []
+    for key in keys:
+        v = 3 * key[0]
+        positions.extend(arrays.positions[v:v + 3])
+        if key[1] is None:
+            normals.extend(arrays.vertexNormals[v:v + 3])
+        else:
+            normals.extend(key[1])
+        if texcoords is not None:
+            texcoords.extend(key[2:4])
+    return VertexBuffers(positions, normals, texcoords, indices)
+
+
+def _dedupVerticesNumpy(arrays, cornerNormals):
+    faceCount = len(arrays.faceSizes)
+    corners = numpy.asarray(arrays.corners, dtype=numpy.int64)
+    cornerFace = numpy.repeat(numpy.arange(faceCount), arrays.faceSizes)
+    flat = ~numpy.asarray(arrays.faceSmooth, dtype=bool)[cornerFace]
+
+    if cornerNormals is None:
+        faceNormals = numpy.round(numpy.asarray(arrays.faceNormals, dtype=numpy.float64).reshape(-1, 3), 8)
+        cornerNormals = faceNormals[cornerFace]
+    else:
+        cornerNormals = numpy.round(numpy.asarray(cornerNormals, dtype=numpy.float64).reshape(-1, 3), 8)
+    cornerNormals[~flat] = 0.0
+
+    columns = 5
+    if arrays.uvs is not None:
+        uvs = numpy.round(numpy.asarray(arrays.uvs, dtype=numpy.float64).reshape(-1, 2), 8)
+        columns = 7
+
+    # One row per corner, packed into a single opaque value for np.unique
+    keys = numpy.empty((len(corners), columns), dtype=numpy.float64)
+    keys[:, 0] = corners
+    keys[:, 1] = flat
+    keys[:, 2:5] = cornerNormals
+    if arrays.uvs is not None:
+        keys[:, 5:7] = uvs
+    keys += 0.0 # -0.0 and 0.0 must not differ in their bits
+    packed = keys.view(numpy.dtype((numpy.void, keys.dtype.itemsize * columns))).ravel()
+    unused, first, inverse = numpy.unique(packed, return_index=True, return_inverse=True)
+
+    # np.unique sorts by key, restore first-use order
+    order = numpy.argsort(first, kind='mergesort')
+    rank = numpy.empty(len(first), dtype=numpy.int64)
+    rank[order] = numpy.arange(len(first))
+    cornerIndices = rank[inverse.ravel()]
+    firstCorners = first[order]
+
+    vertexIndices = corners[firstCorners]
+    positions = numpy.asarray(arrays.positions, dtype=numpy.float64).reshape(-1, 3)[vertexIndices]
+    vertexNormals = numpy.asarray(arrays.vertexNormals, dtype=numpy.float64).reshape(-1, 3)[vertexIndices]
+    normals = numpy.where(flat[firstCorners][:, None], cornerNormals[firstCorners], vertexNormals)
+    texcoords = None
+    if arrays.uvs is not None:
+        texcoords = uvs[firstCorners].ravel().tolist()
+
+    cornerMaterials = numpy.asarray(arrays.faceMaterials, dtype=numpy.int64)[cornerFace]
+    indices = []
+    for m in range(arrays.materialCount):
+        indices.append(cornerIndices[cornerMaterials == m].tolist())
+
+    return VertexBuffers(positions.ravel().tolist(), normals.ravel().tolist(), texcoords, indices)
+
+
+def splitVertexBuffers(buffers, maxVertices):
+    """ Splits buffers into chunks of at most maxVertices vertices each
+
+    Triangles are divided at the median of their centroids along the longest
+    axis until every part is small enough, thus chunks are spatially compact.
+    Each chunk gets compacted vertex arrays of its own, vertices on the cuts
+    are duplicated. Returns [buffers] if it fits already.
+    """
+    if not maxVertices or buffers.vertexCount() <= maxVertices:
+        return [buffers]
+    if maxVertices < 3:
+        raise ValueError("Chunks need room for at least one triangle")
+    triangles, materials = [], []
+    for m, values in enumerate(buffers.indices):
+        triangles.extend(values[:len(values) - len(values) % 3])
+        materials.extend([m] * (len(values) // 3))
+    if numpy:
+        return _splitVertexBuffersNumpy(buffers, triangles, materials, maxVertices)
+    return _splitVertexBuffersPython(buffers, triangles, materials, maxVertices)
+
+
+def _splitVertexBuffersPython(buffers, triangles, materials, maxVertices):
+    positions = buffers.positions
+    centroids = []
+    for c in range(0, len(triangles), 3):
+        a, b, d = 3 * triangles[c], 3 * triangles[c + 1], 3 * triangles[c + 2]
+        centroids.append(tuple([positions[a + k] + positions[b + k] + positions[d + k] for k in range(3)]))
+
+    parts = []
+    stack = [list(range(len(materials)))]
+    while stack:
+        part = stack.pop()
+        # Closed meshes have about half as many vertices as triangles, thus
+        # large parts are split without counting their vertices
+        if len(part) <= 4 * maxVertices:
+            used = set()
+            for t in part:
+                used.update(triangles[3 * t:3 * t + 3])
+            if len(used) <= maxVertices:
+                parts.append(sorted(part))
+                continue
+        axis = max(range(3), key=lambda k: max([centroids[t][k] for t in part]) - min([centroids[t][k] for t in part]))
+        part.sort(key=lambda t: (centroids[t][axis], t))
+        middle = len(part) // 2
+        stack.append(part[middle:])
+        stack.append(part[:middle])
+
+    chunks = []
+    for part in parts:
+        remap = {}
+        order = []
+        indices = [[] for values in buffers.indices] #@UnusedVariable
+        for t in part:
+            target = indices[materials[t]]
+            for v in triangles[3 * t:3 * t + 3]:
+                index = remap.get(v)
+                if index is None:
+                    index = remap[v] = len(order)
+                    order.append(v)
+                target.append(index)
+        chunks.append(_vertexSubset(buffers, order, indices))
+    return chunks
+
+
+def _vertexSubset(buffers, order, indices):
+    def pick(values, size):
+        if values is None:
+            return None
+        result = []
+        for v in order:
+            result.extend(values[size * v:size * v + size])
+        return result
+    return VertexBuffers(pick(buffers.positions, 3), pick(buffers.normals, 3), pick(buffers.texcoords, 2), indices)
+
+
+def _splitVertexBuffersNumpy(buffers, triangles, materials, maxVertices):
+    triangles = numpy.asarray(triangles, dtype=numpy.int64).reshape(-1, 3)
+    materials = numpy.asarray(materials, dtype=numpy.int64)
+    positions = numpy.asarray(buffers.positions, dtype=numpy.float64).reshape(-1, 3)
+    normals = numpy.asarray(buffers.normals, dtype=numpy.float64).reshape(-1, 3)
+    texcoords = None
+    if buffers.texcoords is not None:
+        texcoords = numpy.asarray(buffers.texcoords, dtype=numpy.float64).reshape(-1, 2)
+    centroids = positions[triangles].sum(axis=1)
+
+    parts = []
+    stack = [numpy.arange(len(triangles))]
+    while stack:
+        part = stack.pop()
+        # Closed meshes have about half as many vertices as triangles, thus
+        # large parts are split without counting their vertices
+        if len(part) <= 4 * maxVertices and len(numpy.unique(triangles[part])) <= maxVertices:
+            parts.append(numpy.sort(part))
+            continue
+        points = centroids[part]
+        axis = numpy.argmax(points.max(axis=0) - points.min(axis=0))
+        middle = len(part) // 2
+        order = numpy.lexsort((part, points[:, axis]))
+        stack.append(part[order[middle:]])
+        stack.append(part[order[:middle]])
+
+    chunks = []
+    for part in parts:
+        corners = triangles[part].ravel()
+        used, first, inverse = numpy.unique(corners, return_index=True, return_inverse=True)
+        # Number the vertices of the chunk in the order they are first used
+        order = numpy.argsort(first, kind='mergesort')
+        rank = numpy.empty(len(used), dtype=numpy.int64)
+        rank[order] = numpy.arange(len(used))
+        local = rank[inverse.ravel()].reshape(-1, 3)
+        vertices = used[order]
+        partMaterials = materials[part]
+        indices = [local[partMaterials == m].ravel().tolist() for m in range(len(buffers.indices))]
+        chunkTexcoords = None
+        if texcoords is not None:
+            chunkTexcoords = texcoords[vertices].ravel().tolist()
+        chunks.append(VertexBuffers(positions[vertices].ravel().tolist(), normals[vertices].ravel().tolist(),
+                                    chunkTexcoords, indices))
+    return chunks
+
+
+def averageCacheMissRatio(indices, cacheSize):
+    """ Vertex cache misses per triangle of a FIFO cache with cacheSize entries """
+    if not indices:
+        return 0.0
+    misses = 0
+    fifo = collections.deque()
+    cached = set()
+    for v in indices:
+        if v not in cached:
+            misses += 1
+            fifo.append(v)
+            cached.add(v)
+            if len(fifo) > cacheSize:
+                cached.discard(fifo.popleft())
+    return misses * 3.0 / len(indices)
+
+
+def tipsify(indices, vertexCount, cacheSize):
+    """ Reorders a triangle list for a vertex cache with cacheSize entries
+
+    Tipsify by Sander, Nehab and Barczak: fans the triangles around a vertex
+    and then moves on to the vertex that is most likely still in the cache.
+    Runs in linear time and needs no tuning besides the cache size.
+    """
+    triangleCount = len(indices) // 3
+    liveCount = [0] * vertexCount
+    for v in indices:
+        liveCount[v] += 1
+
+    # Triangles per vertex, as offsets into one flat list
+    offsets = [0] * (vertexCount + 1)
+    total = 0
+    for v in range(vertexCount):
+        offsets[v] = total
+        total += liveCount[v]
+    offsets[vertexCount] = total
+    fill = offsets[:]
+    adjacency = [0] * total
+    for c, v in enumerate(indices):
+        adjacency[fill[v]] = c // 3
+        fill[v] += 1
+
+    cacheTime = [0] * vertexCount
+    emitted = [False] * triangleCount
+    deadEnd = []
+    result = []
+    clock = cacheSize + 1
+    cursor = 0
+    fan = -1
+    if indices:
+        fan = indices[0]
+
+    while fan >= 0:
+        candidates = []
+        for t in adjacency[offsets[fan]:offsets[fan + 1]]:
+            if emitted[t]:
+                continue
+            emitted[t] = True
+            for v in indices[3 * t:3 * t + 3]:
+                result.append(v)
+                deadEnd.append(v)
+                candidates.append(v)
+                liveCount[v] -= 1
+                if clock - cacheTime[v] > cacheSize:
+                    cacheTime[v] = clock
+                    clock += 1
+
+        # Prefer the candidate that stays longest in the cache if all its
+        # remaining triangles are emitted next
+        fan = -1
+        best = -1
+        for v in candidates:
+            if liveCount[v] > 0:
+                priority = 0
+                if clock - cacheTime[v] + 2 * liveCount[v] <= cacheSize:
+                    priority = clock - cacheTime[v]
+                if priority > best:
+                    best = priority
+                    fan = v
+        if fan >= 0:
+            continue
+
+        # Dead end, go back to recently used vertices and then to the input order
+        while deadEnd:
+            v = deadEnd.pop()
+            if liveCount[v] > 0:
+                fan = v
+                break
+        if fan >= 0:
+            continue
+        while cursor < vertexCount:
+            if liveCount[cursor] > 0:
+                fan = cursor
+                break
+            cursor += 1
+    return result
+
+
+def optimizeVertexCache(buffers, cacheSize):
+    """ Reorders the triangles of every material with tipsify and then
+    renumbers the vertices in the order they are fetched.
+
+    Returns the new buffers and the ACMR of all indices before and after.
+    """
+    allIndices = []
+    for values in buffers.indices:
+        allIndices.extend(values)
+    before = averageCacheMissRatio(allIndices, cacheSize)
+
+    vertexCount = buffers.vertexCount()
+    reordered = [tipsify(values, vertexCount, cacheSize) for values in buffers.indices]
+
+    # Number the vertices by first use, thus attributes are fetched in order
+    remap = [-1] * vertexCount
+    order = []
+    indices = []
+    for values in reordered:
+        target = []
+        for v in values:
+            index = remap[v]
+            if index < 0:
+                index = remap[v] = len(order)
+                order.append(v)
+            target.append(index)
+        indices.append(target)
+
+    def permute(values, size):
+        if values is None:
+            return None
+        result = []
+        for v in order:
+            result.extend(values[size * v:size * v + size])
+        return result
+
+    optimized = VertexBuffers(permute(buffers.positions, 3), permute(buffers.normals, 3),
+                              permute(buffers.texcoords, 2), indices)
+    allIndices = []
+    for values in indices:
+        allIndices.extend(values)
+    return optimized, before, averageCacheMissRatio(allIndices, cacheSize)
+
+
+def _growStrip(strip, edges, visited):
+    # Triangle i of a strip is (s[i], s[i+1], s[i+2]) for even i and
+    # (s[i+1], s[i], s[i+2]) for odd i, thus the winding is kept
+    added = []
+    while True:
+        i = len(strip) - 2
+        if i % 2:
+            edge = (strip[i + 1], strip[i])
+        else:
+            edge = (strip[i], strip[i + 1])
+        for t, third in edges.get(edge, ()):
+            if not visited[t]:
+                break
+        else:
+            return added
+        visited[t] = True
+        added.append(t)
+        strip.append(third)
+
+
+def stripify(indices):
+    """ Converts a triangle list into one triangle strip.
+
+    Strips are grown greedily along shared edges, starting from each of the
+    three edges of the first unused triangle and keeping the longest one.
+    Separate strips are joined with degenerate triangles.
+    """
+    triangleCount = len(indices) // 3
+    edges = {}
+    for t in range(triangleCount):
+        a, b, c = indices[3 * t:3 * t + 3]
+        edges.setdefault((a, b), []).append((t, c))
+        edges.setdefault((b, c), []).append((t, a))
+        edges.setdefault((c, a), []).append((t, b))
+
+    visited = [False] * triangleCount
+    result = []
+    for t in range(triangleCount):
+        if visited[t]:
+            continue
+        a, b, c = indices[3 * t:3 * t + 3]
+        best = bestAdded = None
+        visited[t] = True
+        for start in ([a, b, c], [b, c, a], [c, a, b]):
+            added = _growStrip(start, edges, visited)
+            for u in added:
+                visited[u] = False
+            if best is None or len(start) > len(best):
+                best, bestAdded = start, added
+        for u in bestAdded:
+            visited[u] = True
+
+        if result:
+            # A strip has to start at an even position to keep its winding
+            result.append(result[-1])
+            if len(result) % 2 == 0:
+                result.append(result[-1])
+            result.append(best[0])
+        result.extend(best)
+    return result
+
+
+def _planeQuadric(p0, p1, p2):
+    # Area weighted quadric of the plane through a triangle, as the upper
+    # triangle of the symmetric 4x4 matrix followed by the weight
+    ux, uy, uz = p1[0] - p0[0], p1[1] - p0[1], p1[2] - p0[2]
+    vx, vy, vz = p2[0] - p0[0], p2[1] - p0[1], p2[2] - p0[2]
+    a, b, c = uy * vz - uz * vy, uz * vx - ux * vz, ux * vy - uy * vx
+    length = (a * a + b * b + c * c) ** 0.5
+    if length == 0.0:
+        return None
+    weight = length * 0.5
+    a, b, c = a / length, b / length, c / length
+    d = -(a * p0[0] + b * p0[1] + c * p0[2])
+    return [weight * a * a, weight * a * b, weight * a * c, weight * a * d,
+            weight * b * b, weight * b * c, weight * b * d,
+            weight * c * c, weight * c * d, weight * d * d, weight]
+
+
+def _quadricError(q, p):
+    x, y, z = p
+    return (q[0] * x * x + 2.0 * q[1] * x * y + 2.0 * q[2] * x * z + 2.0 * q[3] * x +
+            q[4] * y * y + 2.0 * q[5] * y * z + 2.0 * q[6] * y +
+            q[7] * z * z + 2.0 * q[8] * z + q[9])
+
+
+def _lockedVertices(buffers, triangles, materials, points):
+    # Vertices on open or non-manifold edges, on material boundaries and all
+    # copies of a position that was split by dedup (UV seams, hard edges)
+    # have to stay where they are
+    vertexCount = buffers.vertexCount()
+    locked = [False] * vertexCount
+    copies = {}
+    for v in range(vertexCount):
+        copies.setdefault(points[v], []).append(v)
+    for group in copies.values():
+        if len(group) > 1:
+            for v in group:
+                locked[v] = True
+
+    edgeUses = {}
+    vertexMaterial = [-1] * vertexCount
+    for t, triangle in enumerate(triangles):
+        for k in range(3):
+            u, v = triangle[k], triangle[(k + 1) % 3]
+            edge = (min(u, v), max(u, v))
+            edgeUses[edge] = edgeUses.get(edge, 0) + 1
+            if vertexMaterial[u] < 0:
+                vertexMaterial[u] = materials[t]
+            elif vertexMaterial[u] != materials[t]:
+                locked[u] = True
+    for (u, v), uses in edgeUses.items():
+        if uses != 2:
+            locked[u] = locked[v] = True
+    return locked
+
+
+# Smallest cosine between the normal of a triangle before and after a
+# collapse, and between its normal and the one of its original face
+COLLAPSE_NORMAL_COS = 0.3
+
+
+def _unitNormal(p0, p1, p2):
+    ux, uy, uz = p1[0] - p0[0], p1[1] - p0[1], p1[2] - p0[2]
+    vx, vy, vz = p2[0] - p0[0], p2[1] - p0[1], p2[2] - p0[2]
+    a, b, c = uy * vz - uz * vy, uz * vx - ux * vz, ux * vy - uy * vx
+    length = (a * a + b * b + c * c) ** 0.5
+    if length == 0.0:
+        return None
+    return (a / length, b / length, c / length)
+
+
+def simplifyMesh(buffers, ratios):
+    """ Quadric error decimation (Garland and Heckbert) of the triangles of buffers
+
+    Vertices are collapsed onto a neighbour, thus all levels share the vertex
+    arrays of buffers and only differ in their indices. Returns a list of
+    (ratio, index list per material, error) with one level per ratio of the
+    original triangle count. error is the largest root mean square distance
+    of a collapsed vertex to the planes of its original triangles, in object
+    space. Levels stop early if nothing can be collapsed anymore.
+
+    A collapse is rejected if it turns a triangle by more than
+    acos(COLLAPSE_NORMAL_COS), either against its current normal or against
+    the normal of the face it was made from, thus no level flips triangles.
+    """
+    import heapq
+
+    positions = buffers.positions
+    points = [tuple(positions[3 * v:3 * v + 3]) for v in range(buffers.vertexCount())]
+    triangles, materials = [], []
+    for m, values in enumerate(buffers.indices):
+        for c in range(0, len(values) - 2, 3):
+            triangles.append(list(values[c:c + 3]))
+            materials.append(m)
+
+    vertexCount = len(points)
+    quadrics = [[0.0] * 11 for v in range(vertexCount)] #@UnusedVariable
+    vertexTriangles = [set() for v in range(vertexCount)] #@UnusedVariable
+    for t, triangle in enumerate(triangles):
+        q = _planeQuadric(points[triangle[0]], points[triangle[1]], points[triangle[2]])
+        for v in triangle:
+            vertexTriangles[v].add(t)
+            if q:
+                target = quadrics[v]
+                for k in range(11):
+                    target[k] += q[k]
+    locked = _lockedVertices(buffers, triangles, materials, points)
+    sourceNormals = [_unitNormal(points[a], points[b], points[c]) for a, b, c in triangles]
+
+    alive = [True] * len(triangles)
+    removed = [False] * vertexCount
+    version = [0] * vertexCount
+    heap = []
+
+    def neighbours(v):
+        result = set()
+        for t in vertexTriangles[v]:
+            result.update(triangles[t])
+        result.discard(v)
+        return result
+
+    def push(u, v):
+        # Collapse u onto v
+        if locked[u]:
+            return
+        q = [a + b for a, b in zip(quadrics[u], quadrics[v])]
+        heapq.heappush(heap, (max(_quadricError(q, points[v]), 0.0), u, v, version[u], version[v]))
+
+    def canCollapse(u, v):
+        shared = [t for t in vertexTriangles[u] if v in triangles[t]]
+        # Link condition, otherwise the collapse folds the surface onto itself
+        if len(neighbours(u) & neighbours(v)) != len(shared):
+            return False
+        for t in vertexTriangles[u]:
+            if v in triangles[t]:
+                continue
+            corners = [points[w] for w in triangles[t]]
+            before = _unitNormal(*corners)
+            corners[triangles[t].index(u)] = points[v]
+            after = _unitNormal(*corners)
+            if after is None:
+                return False
+            for n in (before, sourceNormals[t]):
+                if n is not None and n[0] * after[0] + n[1] * after[1] + n[2] * after[2] < COLLAPSE_NORMAL_COS:
+                    return False
+        return True
+
+    for u in range(vertexCount):
+        for v in neighbours(u):
+            push(u, v)
+
+    levels = []
+    targets = sorted(set(ratios), reverse=True)
+    triangleCount = len(triangles)
+    error = 0.0
+
+    def snapshot(ratio):
+        indices = [[] for m in buffers.indices] #@UnusedVariable
+        for t, triangle in enumerate(triangles):
+            if alive[t]:
+                indices[materials[t]].extend(triangle)
+        levels.append((ratio, indices, error))
+
+    for ratio in targets:
+        target = int(len(triangles) * ratio)
+        while triangleCount > target and heap:
+            cost, u, v, versionU, versionV = heapq.heappop(heap)
+            if removed[u] or removed[v] or version[u] != versionU or version[v] != versionV:
+                continue
+            if not canCollapse(u, v):
+                continue
+            for t in list(vertexTriangles[u]):
+                triangle = triangles[t]
+                if v in triangle:
+                    alive[t] = False
+                    triangleCount -= 1
+                    for w in triangle:
+                        vertexTriangles[w].discard(t)
+                else:
+                    triangle[triangle.index(u)] = v
+                    vertexTriangles[v].add(t)
+            vertexTriangles[u] = set()
+            removed[u] = True
+            quadrics[v] = q = [a + b for a, b in zip(quadrics[u], quadrics[v])]
+            if q[10] > 0.0:
+                error = max(error, (max(_quadricError(q, points[v]), 0.0) / q[10]) ** 0.5)
+            # Only collapses with v change their cost, the others stay valid
+            version[v] += 1
+            for w in neighbours(v):
+                push(w, v)
+                push(v, w)
+        snapshot(ratio)
+    return levels
+
+
+def quantizeRange(values, size, bits):
+    """ Maps each of the size components of a flat array linearly from its
+    range onto unsigned integers with bits bits.
+
+    Returns (integers, scale, offset, maximum error), a value is decoded
+    as integer * scale + offset.
+    """
+    levels = float((1 << bits) - 1)
+    if not len(values):
+        return [], [0.0] * size, [0.0] * size, 0.0
+    if numpy:
+        points = numpy.asarray(values, dtype=numpy.float64).reshape(-1, size)
+        lower = points.min(axis=0)
+        scale = (points.max(axis=0) - lower) / levels
+        quantized = numpy.rint((points - lower) / numpy.where(scale > 0.0, scale, 1.0))
+        error = float(numpy.abs(quantized * scale + lower - points).max())
+        return quantized.astype(numpy.int64).ravel().tolist(), scale.tolist(), lower.tolist(), error
+    lower, scale = [], []
+    for axis in range(size):
+        components = values[axis::size]
+        lower.append(min(components))
+        scale.append((max(components) - lower[axis]) / levels)
+    quantized = []
+    error = 0.0
+    for i, value in enumerate(values):
+        axis = i % size
+        q = 0
+        if scale[axis] > 0.0:
+            q = int(round((value - lower[axis]) / scale[axis]))
+        quantized.append(q)
+        error = max(error, abs(q * scale[axis] + lower[axis] - value))
+    return quantized, scale, lower, error
+
+
+def _octahedralNumpy(normals, limit):
+    n = numpy.asarray(normals, dtype=numpy.float64).reshape(-1, 3)
+    lengths = numpy.sqrt((n ** 2).sum(axis=1))
+    n = n / numpy.where(lengths > 0.0, lengths, 1.0)[:, None]
+    l1 = numpy.abs(n).sum(axis=1)
+    p = n[:, :2] / numpy.where(l1 > 0.0, l1, 1.0)[:, None]
+    signs = numpy.where(p >= 0.0, 1.0, -1.0)
+    folded = (1.0 - numpy.abs(p[:, ::-1])) * signs
+    p = numpy.where((n[:, 2] < 0.0)[:, None], folded, p)
+    quantized = numpy.rint(p * limit)
+
+    decoded = numpy.empty_like(n)
+    decoded[:, :2] = quantized / limit
+    decoded[:, 2] = 1.0 - numpy.abs(decoded[:, :2]).sum(axis=1)
+    t = numpy.maximum(-decoded[:, 2], 0.0)
+    decoded[:, :2] -= t[:, None] * numpy.where(decoded[:, :2] >= 0.0, 1.0, -1.0)
+    decoded /= numpy.sqrt((decoded ** 2).sum(axis=1))[:, None]
+    cos = numpy.clip((decoded * n).sum(axis=1), -1.0, 1.0)[lengths > 0.0]
+    error = 0.0
+    if len(cos):
+        error = float(numpy.degrees(numpy.arccos(cos.min())))
+    return quantized.astype(numpy.int64).ravel().tolist(), error
+
+
+def octahedralEncode(normals, bits=8):
+    """ Encodes normals as two signed integers with bits bits each, by
+    mapping the unit sphere onto an octahedron unfolded into a square.
+
+    Returns (integers, maximum error in degrees). A normal is decoded as
+    x, y = integers / (2^(bits-1) - 1), z = 1 - |x| - |y|, if z < 0
+    x -= sign(x) * -z and y -= sign(y) * -z, normalized.
+    """
+    limit = float((1 << (bits - 1)) - 1)
+    if numpy:
+        return _octahedralNumpy(normals, limit)
+    quantized = []
+    error = 0.0
+    for v in range(0, len(normals), 3):
+        x, y, z = normals[v:v + 3]
+        length = (x * x + y * y + z * z) ** 0.5
+        if length > 0.0:
+            x, y, z = x / length, y / length, z / length
+        l1 = (abs(x) + abs(y) + abs(z)) or 1.0
+        px, py = x / l1, y / l1
+        if z < 0.0:
+            px, py = (1.0 - abs(py)) * (px >= 0.0 and 1.0 or -1.0), (1.0 - abs(px)) * (py >= 0.0 and 1.0 or -1.0)
+        qx, qy = int(round(px * limit)), int(round(py * limit))
+        quantized.extend((qx, qy))
+        if length == 0.0:
+            continue
+        dx, dy = qx / limit, qy / limit
+        dz = 1.0 - abs(dx) - abs(dy)
+        t = max(-dz, 0.0)
+        dx -= t * (dx >= 0.0 and 1.0 or -1.0)
+        dy -= t * (dy >= 0.0 and 1.0 or -1.0)
+        cos = (dx * x + dy * y + dz * z) / (dx * dx + dy * dy + dz * dz) ** 0.5
+        error = max(error, math.degrees(math.acos(max(min(cos, 1.0), -1.0))))
+    return quantized, error
+
+
+def _encodeValues(values, typecode, digits, options):
+    if options.binary:
+        return values
+    if typecode == 'i':
+        return formatInts(values)
+    return formatFloats(values, digits)
+
+
+def _quantizeAttributes(buffers, options, chunk):
+    # Positions and texcoords become 16 bit integers over their range with
+    # <name>Scale and <name>Offset to decode them, normals two 8 bit
+    # integers in octahedral encoding
+    errors = chunk.quantizationErrors = {}
+    for element, name, values, size in (('float3', 'position', buffers.positions, 3),
+                                        ('float2', 'texcoord', buffers.texcoords, 2)):
+        if values is None:
+            continue
+        quantized, scale, offset, errors[name] = quantizeRange(values, size, 16)
+        # Still vectors of their element type, with 16 bit integer components
+        chunk.attributes.append((element, name, 'H', _encodeValues(quantized, 'i', None, options)))
+        chunk.attributes.append((element, name + 'Scale', 'f', _encodeValues(scale, 'f', 12, options)))
+        chunk.attributes.append((element, name + 'Offset', 'f', _encodeValues(offset, 'f', 12, options)))
+        if name == 'position':
+            quantized, errors['normal'] = octahedralEncode(buffers.normals)
+            chunk.attributes.append(('int', 'normal', 'b', _encodeValues(quantized, 'i', None, options)))
+
+
+def _encodeChunk(buffers, options, encoded):
+    # Encodes attributes, indices and levels of detail of one chunk
+    chunk = EncodedChunk(buffers.vertexCount())
+    chunk.bounds = boundingVolumes(buffers.positions)
+    if options.vertexCacheSize:
+        start = time.time()
+        buffers, before, after = optimizeVertexCache(buffers, options.vertexCacheSize)
+        chunk.acmr = (before, after)
+        encoded.times["vertex cache"] = encoded.times.get("vertex cache", 0.0) + time.time() - start
+    start = time.time()
+    stripTime = 0.0
+
+    lower, upper = chunk.bounds[:2]
+    if options.quantize:
+        _quantizeAttributes(buffers, options, chunk)
+        encoded.times["quantization"] = encoded.times.get("quantization", 0.0) + time.time() - start
+        start = time.time()
+    else:
+        extent = max([upper[i] - lower[i] for i in range(3)])
+        digits = digitsForExtent(extent, options.positionTolerance)
+        chunk.attributes.append(('float3', 'position', 'f', _encodeValues(buffers.positions, 'f', digits, options)))
+        chunk.attributes.append(('float3', 'normal', 'f', _encodeValues(buffers.normals, 'f', options.normalDigits, options)))
+        if buffers.texcoords is not None:
+            chunk.attributes.append(('float2', 'texcoord', 'f', _encodeValues(buffers.texcoords, 'f', options.texcoordDigits, options)))
+
+    for values in buffers.indices:
+        meshType = "triangles"
+        if options.triangleStrips and len(values):
+            stripStart = time.time()
+            strip = stripify(values)
+            if len(strip) < len(values):
+                values = strip
+                meshType = "tristrips"
+            stripTime += time.time() - stripStart
+        chunk.types.append(meshType)
+        if len(values):
+            chunk.indices.append(_encodeValues(values, 'i', None, options))
+        else:
+            chunk.indices.append(None)
+    if options.triangleStrips:
+        encoded.times["stripification"] = encoded.times.get("stripification", 0.0) + stripTime
+    encoded.times["encoding"] = encoded.times.get("encoding", 0.0) + time.time() - start - stripTime
+
+    if options.lodRatios:
+        start = time.time()
+        diagonal = sum([(upper[i] - lower[i]) ** 2 for i in range(3)]) ** 0.5
+        for ratio, indices, error in simplifyMesh(buffers, options.lodRatios):
+            payloads = []
+            for values in indices:
+                if options.vertexCacheSize:
+                    values = tipsify(values, buffers.vertexCount(), options.vertexCacheSize)
+                if len(values):
+                    payloads.append(_encodeValues(values, 'i', None, options))
+                else:
+                    payloads.append(None)
+            relativeError = 0.0
+            if diagonal > 0.0:
+                relativeError = error / diagonal
+            triangles = sum([len(values) for values in indices]) // 3
+            chunk.lods.append((ratio, triangles, error, relativeError, payloads))
+        encoded.times["simplification"] = encoded.times.get("simplification", 0.0) + time.time() - start
+    return chunk
+
+
+def encodeMesh(job):
+    """ Triangulates, deduplicates, splits and encodes the arrays of a mesh. job is (arrays, options)
+
+    Runs in worker processes, thus job and result have to be picklable.
+    """
+    arrays, options = job
+    start = time.time()
+    faceCount = len(arrays.faceSizes)
+    arrays = triangulate(arrays)
+    triangulationTime = time.time() - start
+    start = time.time()
+    cornerNormals = None
+    if options.autoSmoothAngle:
+        cornerNormals = weldNormals(arrays, options.autoSmoothAngle)
+        weldingTime = time.time() - start
+        start = time.time()
+    buffers = dedupVertices(arrays, cornerNormals)
+    del cornerNormals
+    encoded = EncodedMesh(faceCount, len(arrays.faceSizes), len(arrays.corners), buffers.vertexCount())
+    encoded.times["triangulation"] = triangulationTime
+    if options.autoSmoothAngle:
+        encoded.times["normal welding"] = weldingTime
+    encoded.times["dedup"] = time.time() - start
+    encoded.bounds = boundingVolumes(buffers.positions)
+
+    start = time.time()
+    parts = splitVertexBuffers(buffers, options.maxChunkVertices)
+    if len(parts) > 1:
+        encoded.times["chunking"] = time.time() - start
+        encoded.vertexCount = sum([part.vertexCount() for part in parts])
+    del buffers
+
+    for part in parts:
+        encoded.chunks.append(_encodeChunk(part, options, encoded))
+
+    if options.vertexCacheSize:
+        # Misses per triangle of all chunks together
+        weights = [sum([len(values) for values in part.indices]) for part in parts]
+        total = float(sum(weights)) or 1.0
+        encoded.acmr = tuple([sum([chunk.acmr[k] * weight for chunk, weight in zip(encoded.chunks, weights)]) / total
+                              for k in range(2)])
+    return encoded
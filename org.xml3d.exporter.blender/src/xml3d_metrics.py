@@ -0,0 +1,154 @@
+# --------------------------------------------------------------------------
+# XML3D exporter: export metrics
+# --------------------------------------------------------------------------
+# ***** BEGIN GPL LICENSE BLOCK *****
+#
+# Copyright (C) 2010: DFKI GmbH, kristian.sons@dfki.de
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+#
+# ***** END GPL LICENCE BLOCK *****
+# --------------------------------------------------------------------------
+
+import json
+import sys
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def tracedPeakMemory():
+    """ Peak of the Python heap in bytes since tracing started or the last
+    reset, None unless tracemalloc runs """
+    if tracemalloc and tracemalloc.is_tracing():
+        return tracemalloc.get_traced_memory()[1]
+    return None
+
+
+def processPeakMemory():
+    """ Peak resident memory in bytes over the whole lifetime of the process,
+    which includes everything Blender did before the export. None if it
+    cannot be determined """
+    if resource:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports kilobytes, Mac OS X bytes
+        if sys.platform != 'darwin':
+            peak *= 1024
+        return peak
+    return None
+
+
+class ExportMetrics:
+    """ Wall time and peak memory per export phase and statistics per mesh
+
+    Phases may nest and may be entered several times, their times add up.
+    Phases running in worker processes only report their summed time.
+    Peak memory per phase is only known with traceMemory, otherwise the
+    report holds the peak of the whole process alone.
+    """
+
+    def __init__(self, traceMemory = False):
+        self.phases = {}
+        self.phaseOrder = []
+        self.meshes = []
+        self.textures = []
+        self.animations = []
+        self._started = {}
+        self._startTime = time.time()
+        self._tracing = False
+        if traceMemory and tracemalloc and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._tracing = True
+
+    def _phase(self, name):
+        if name not in self.phases:
+            self.phases[name] = { "seconds": 0.0 }
+            if self._tracing:
+                self.phases[name]["peakMemory"] = None
+            self.phaseOrder.append(name)
+        return self.phases[name]
+
+    def begin(self, name):
+        self._phase(name)
+        # Python 3.9 can measure the peak of each phase separately
+        if self._tracing and hasattr(tracemalloc, 'reset_peak') and not self._started:
+            tracemalloc.reset_peak()
+        self._started[name] = time.time()
+
+    def end(self, name):
+        phase = self._phase(name)
+        phase["seconds"] += time.time() - self._started.pop(name)
+        if self._tracing:
+            phase["peakMemory"] = max(phase["peakMemory"] or 0, tracedPeakMemory())
+
+    def addTimes(self, times):
+        """ Adds a dict of phase name to seconds, measured elsewhere """
+        for name, seconds in times.items():
+            self._phase(name)["seconds"] += seconds
+
+    def addMesh(self, name, faces, triangles, corners, vertices, bytes, acmr=None, lods=None, quantizationErrors=None):
+        """ faces are the polygons of the source mesh, corners those of its triangles """
+        ratio = 0.0
+        if vertices:
+            ratio = float(corners) / vertices
+        mesh = { "name": name, "faces": faces, "triangles": triangles, "corners": corners,
+                 "vertices": vertices, "dedupRatio": ratio, "bytes": bytes }
+        if acmr:
+            mesh["acmrBefore"], mesh["acmrAfter"] = acmr
+        if lods:
+            mesh["lods"] = lods
+        if quantizationErrors:
+            mesh["quantizationErrors"] = quantizationErrors
+        self.meshes.append(mesh)
+
+    def addTexture(self, name, width, height, bytes, cached, seconds):
+        self.textures.append({ "name": name, "width": width, "height": height,
+                               "bytes": bytes, "cached": cached, "seconds": seconds })
+
+    def addAnimation(self, name, samples, keys):
+        """ keys is the number of keys by track, of the tracks that were written """
+        self.animations.append({ "name": name, "samples": samples, "keys": keys })
+
+    def writeReport(self, filename, outputFiles):
+        """ Writes the metrics as JSON, stopping memory tracing """
+        report = {
+            "seconds": time.time() - self._startTime,
+            "processPeak": processPeakMemory(),
+            "outputBytes": sum([size for name, size in outputFiles]),
+            "outputFiles": dict(outputFiles),
+            "phases": [dict(name = name, **self.phases[name]) for name in self.phaseOrder],
+            "meshes": self.meshes,
+            "textures": self.textures,
+            "animations": self.animations,
+        }
+        if self._tracing:
+            # Peaks are reset per phase, the overall one is the largest of them
+            peaks = [phase["peakMemory"] or 0 for phase in self.phases.values()]
+            report["peakMemory"] = max(peaks + [tracedPeakMemory()])
+            tracemalloc.stop()
+            self._tracing = False
+        f = open(filename, 'w')
+        try:
+            json.dump(report, f, indent = 1, sort_keys = True)
+        finally:
+            f.close()
@@ -0,0 +1,176 @@
+# --------------------------------------------------------------------------
+# XML3D exporter: texture processing
+# --------------------------------------------------------------------------
+# ***** BEGIN GPL LICENSE BLOCK *****
+#
+# Copyright (C) 2010: DFKI GmbH, kristian.sons@dfki.de
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+#
+# ***** END GPL LICENCE BLOCK *****
+# --------------------------------------------------------------------------
+#
+# Works on image files only, thus nothing in here depends on the Blender
+# API. Resizing needs PIL, without it images are copied unchanged.
+
+import hashlib
+import os
+import shutil
+import time
+
+try:
+    from PIL import Image
+except ImportError:
+    try:
+        import Image
+    except ImportError:
+        Image = None
+
+# Part of every texture file name, change whenever processTexture produces different output
+TEXTURE_VERSION = 1
+
+_EXTENSIONS = { "png": ".png", "jpeg": ".jpg" }
+
+
+class TextureOptions:
+    """ Export options that influence the processed texture files """
+
+    def __init__(self):
+        self.maxSize = 2048     # longest side in pixels, 0 keeps the size
+        self.powerOfTwo = True
+        self.format = None      # "png" or "jpeg", None picks png for images with alpha
+        self.quality = 90       # of jpeg files
+        self.mipmaps = False
+
+
+class TextureResult:
+    """ The files written for a source image """
+
+    def __init__(self, filename, width, height):
+        self.filename = filename  # in the texture directory
+        self.width = width        # None if the image was copied unchanged
+        self.height = height
+        self.mipmaps = []         # file names of the smaller levels, largest first
+        self.bytes = 0
+        self.cached = False       # all files existed already
+        self.seconds = 0.0
+
+
+def textureHash(path, options):
+    """ SHA-1 over the content of an image file and the options it is processed with """
+    digest = hashlib.sha1()
+    f = open(path, 'rb')
+    try:
+        while True:
+            block = f.read(1 << 20)
+            if not block:
+                break
+            digest.update(block)
+    finally:
+        f.close()
+    settings = sorted(vars(options).items())
+    digest.update(repr((TEXTURE_VERSION, Image is not None, settings)).encode('ascii'))
+    return digest.hexdigest()
+
+
+def nearestPowerOfTwo(size):
+    result = 1
+    while result * 2 <= size:
+        result *= 2
+    if size - result > result * 2 - size:
+        result *= 2
+    return result
+
+
+def textureSize(width, height, options):
+    """ The size an image of width x height is resized to """
+    if options.maxSize and max(width, height) > options.maxSize:
+        scale = float(options.maxSize) / max(width, height)
+        width = max(int(round(width * scale)), 1)
+        height = max(int(round(height * scale)), 1)
+    if options.powerOfTwo:
+        width, height = nearestPowerOfTwo(width), nearestPowerOfTwo(height)
+        while options.maxSize and max(width, height) > options.maxSize:
+            width, height = max(width // 2, 1), max(height // 2, 1)
+    return width, height
+
+
+def _save(image, path, format, options):
+    # Written under a temporary name first, thus an aborted export never
+    # leaves a truncated file that a later export would take as cached
+    temporary = path + ".tmp"
+    if format == "jpeg":
+        image.save(temporary, "JPEG", quality=options.quality, optimize=True)
+    else:
+        image.save(temporary, "PNG", optimize=True)
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(temporary, path)
+
+
+def processTexture(job):
+    """ Resizes and re-encodes a source image into directory. job is (source, directory, key, options)
+
+    File names contain key, files that exist already are kept. Runs in
+    worker processes, thus job and result have to be picklable.
+    """
+    source, directory, key, options = job
+    start = time.time()
+    stem = os.path.splitext(os.path.basename(source))[0]
+
+    if Image is None:
+        filename = "%s-%s%s" % (stem, key[:12], os.path.splitext(source)[1])
+        result = TextureResult(filename, None, None)
+        path = os.path.join(directory, filename)
+        result.cached = os.path.exists(path)
+        if not result.cached:
+            shutil.copyfile(source, path + ".tmp")
+            os.rename(path + ".tmp", path)
+        result.bytes = os.path.getsize(path)
+        result.seconds = time.time() - start
+        return result
+
+    image = Image.open(source)
+    hasAlpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+    format = options.format
+    if not format:
+        format = hasAlpha and "png" or "jpeg"
+    extension = _EXTENSIONS[format]
+    width, height = textureSize(image.size[0], image.size[1], options)
+
+    names = ["%s-%s%s" % (stem, key[:12], extension)]
+    sizes = [(width, height)]
+    while options.mipmaps and sizes[-1] != (1, 1):
+        sizes.append((max(sizes[-1][0] // 2, 1), max(sizes[-1][1] // 2, 1)))
+        names.append("%s-%s-mip%i%s" % (stem, key[:12], len(names), extension))
+
+    result = TextureResult(names[0], width, height)
+    result.mipmaps = names[1:]
+    paths = [os.path.join(directory, name) for name in names]
+    result.cached = not [path for path in paths if not os.path.exists(path)]
+    if not result.cached:
+        if format == "jpeg":
+            image = image.convert("RGB")
+        elif image.mode not in ("RGB", "RGBA", "L", "LA"):
+            image = image.convert(hasAlpha and "RGBA" or "RGB")
+        resample = getattr(Image, "LANCZOS", None) or Image.ANTIALIAS
+        for path, size in zip(paths, sizes):
+            # Every level is filtered down from the one before
+            if image.size != size:
+                image = image.resize(size, resample)
+            _save(image, path, format, options)
+    result.bytes = sum([os.path.getsize(path) for path in paths])
+    result.seconds = time.time() - start
+    return result
@@ -0,0 +1,46 @@
+"""
+Helpers for tests that run the exporter with the fake Blender API of the
+benchmark folder.
+"""
+
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "benchmark", "fakeblender"))
+sys.path.insert(0, os.path.join(HERE, "..", "benchmark"))
+sys.path.insert(0, os.path.join(HERE, "..", "src"))
+
+
+def exportScene(directory, faces=2000, meshes=3, prepare=None, **options):
+    """ Exports a benchmark scene to scene.xhtml in directory, with options
+    as exporter attributes. prepare is called with the scene before the
+    export. Returns the file name """
+    import scenes
+    # Importing the exporter runs its (fake) GUI entry point
+    import xml3d_exporter
+    scene = scenes.makeScene(faces, meshes)
+    if prepare:
+        prepare(scene)
+    filename = os.path.join(directory, "scene.xhtml")
+    exporter = xml3d_exporter.xml3d_exporter(filename, False)
+    exporter.metricsReport = False
+    for name, value in options.items():
+        setattr(exporter, name, value)
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        exporter.write(scene)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    return filename
+
+
+def elementsById(document):
+    """ The elements of a minidom document by their id attribute """
+    result = {}
+    for element in document.getElementsByTagName("*"):
+        if element.getAttribute("id"):
+            result[element.getAttribute("id")] = element
+    return result
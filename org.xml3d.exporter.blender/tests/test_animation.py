@@ -0,0 +1,49 @@
+import math
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from xml3d_animation import axisAngleToQuaternion, reduceTrack, rotationAngle
+
+
+def playBack(track, time):
+    """ The rotation at time like a client interpolates it, along the shorter arc """
+    times, values = track.times, track.values
+    k = 0
+    while k + 2 < len(times) and times[k + 1] <= time:
+        k += 1
+    a, b = values[4 * k:4 * k + 4], values[4 * k + 4:4 * k + 8]
+    t = (time - times[k]) / (times[k + 1] - times[k])
+    cos = sum([x * y for x, y in zip(a, b)])
+    if cos < 0.0:
+        b, cos = [-y for y in b], -cos
+    angle = math.acos(min(cos, 1.0))
+    if angle < 1e-9:
+        return a
+    wa, wb = math.sin((1.0 - t) * angle) / math.sin(angle), math.sin(t * angle) / math.sin(angle)
+    return [x * wa + y * wb for x, y in zip(a, b)]
+
+
+class ReduceRotationTest(unittest.TestCase):
+
+    def testSteadyRotationPlaysBackWithinTolerance(self):
+        # 3 degrees per frame for 10 seconds at 25 frames per second
+        times = [frame / 25.0 for frame in range(250)]
+        samples = [axisAngleToQuaternion((0.0, 0.3, 1.0), math.radians(3.0 * frame)) for frame in range(250)]
+        tolerance = math.radians(0.1)
+        track = reduceTrack("rotation", times, samples, tolerance)
+
+        self.assertTrue(2 < len(track.times) < 250)
+        values = track.values
+        for k in range(len(track.times) - 1):
+            cos = sum([x * y for x, y in zip(values[4 * k:4 * k + 4], values[4 * k + 4:4 * k + 8])])
+            self.assertTrue(cos >= 0.0, "keys %i and %i are more than 180 degrees apart" % (k, k + 1))
+        for time, sample in zip(times, samples):
+            error = rotationAngle(playBack(track, time), sample)
+            self.assertTrue(error <= tolerance + 1e-9, "%.3f degrees off at %.2f s" % (math.degrees(error), time))
+
+
+if __name__ == "__main__":
+    unittest.main()
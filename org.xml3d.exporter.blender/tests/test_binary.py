@@ -0,0 +1,50 @@
+import os
+import shutil
+import tempfile
+import unittest
+from xml.dom import minidom
+
+from support import exportScene
+
+
+class IndexTypeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def exportIndices(self, **options):
+        """ (id of the data block, index element) of a binary export and the
+        index counts by data block id of the same export as text """
+        text = os.path.join(self.directory, "text")
+        binary = os.path.join(self.directory, "binary")
+        os.mkdir(text)
+        os.mkdir(binary)
+        counts = {}
+        for element in minidom.parse(exportScene(text, **options)).getElementsByTagName("int"):
+            if element.getAttribute("name") == "index":
+                counts[element.parentNode.getAttribute("id")] = len(element.firstChild.data.split())
+        indices = []
+        for element in minidom.parse(exportScene(binary, binaryBuffers=True, **options)).getElementsByTagName("int"):
+            if element.getAttribute("name") == "index":
+                indices.append((element.parentNode.getAttribute("id"), element))
+        self.assertEqual(sorted(counts), sorted([name for name, element in indices]))
+        return indices, counts
+
+    def testChunkIndicesAre16Bit(self):
+        indices, counts = self.exportIndices(lodRatios=(0.5,))
+        for name, element in indices:
+            self.assertEqual(element.getAttribute("componentType"), "uint16")
+            self.assertEqual(int(element.getAttribute("byteLength")), 2 * counts[name])
+
+    def testIndicesOfLargeMeshesAre32Bit(self):
+        indices, counts = self.exportIndices(faces=70000, meshes=1, maxChunkVertices=0)
+        for name, element in indices:
+            self.assertEqual(element.getAttribute("componentType"), "")
+            self.assertEqual(int(element.getAttribute("byteLength")), 4 * counts[name])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+import shutil
+import tempfile
+import unittest
+from xml.dom import minidom
+
+from support import exportScene, elementsById
+
+
+class LodMarkupTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testLevelsAreLinkedAndDescribed(self):
+        ratios = (0.5, 0.1)
+        document = minidom.parse(exportScene(self.directory, lodRatios=ratios))
+        elements = elementsById(document)
+
+        linked = []
+        for data in document.getElementsByTagName("data"):
+            if not data.getAttribute("lods"):
+                continue
+            indices = [e for e in data.childNodes if e.nodeType == e.ELEMENT_NODE and e.getAttribute("name") == "index"]
+            self.assertEqual(len(indices), 1, "lods on %s, which has no indices" % data.getAttribute("id"))
+            links = data.getAttribute("lods").split()
+            self.assertEqual(len(links), len(ratios))
+            for link, ratio in zip(links, ratios):
+                self.assertTrue(link.startswith("#"))
+                lod = elements[link[1:]]
+                self.assertEqual(float(lod.getAttribute("lod-ratio")), ratio)
+                self.assertTrue(float(lod.getAttribute("lod-error")) >= 0.0)
+                # The level has its own indices and refers to the vertex data
+                names = [e.getAttribute("name") for e in lod.getElementsByTagName("int")]
+                self.assertEqual(names, ["index"])
+                sources = [e.getAttribute("src") for e in lod.getElementsByTagName("data")]
+                self.assertEqual(len(sources), 1)
+                self.assertTrue(elements[sources[0][1:]].getElementsByTagName("float3"))
+                linked.append(link[1:])
+
+        levels = [name for name in elements if "_lod" in name]
+        self.assertTrue(levels)
+        self.assertEqual(sorted(levels), sorted(linked))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+import os
+import shutil
+import tempfile
+import unittest
+from xml.dom import minidom
+
+from support import exportScene
+import xml3d_texture
+
+
+class MipmapTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def exportTextured(self, **options):
+        """ Exports a scene whose materials have a 100 x 60 image texture,
+        returns its texture elements """
+        import Blender, bpy
+        image = os.path.join(self.directory, "image.png")
+        xml3d_texture.Image.new("RGB", (100, 60), (200, 10, 10)).save(image)
+
+        def prepare(scene):
+            Blender.setCurrentScene(scene, os.path.join(self.directory, "scene.blend"))
+            for material in bpy.data.materials:
+                texture = Blender.TextureData("image", Blender.ImageData("image", "//image.png"))
+                material.textures[0] = Blender.MTex(texture)
+
+        filename = exportScene(self.directory, prepare=prepare, exportTextures=True, **options)
+        return minidom.parse(filename).getElementsByTagName("texture")
+
+    def textureFiles(self):
+        return os.listdir(os.path.join(self.directory, "textures"))
+
+    def testNoMipmapsByDefault(self):
+        if xml3d_texture.Image is None:
+            return
+        textures = self.exportTextured()
+        self.assertTrue(textures)
+        for texture in textures:
+            self.assertEqual(texture.getAttribute("mipmaps"), "")
+        self.assertEqual([name for name in self.textureFiles() if "-mip" in name], [])
+
+    def testMipmapsAreReferenced(self):
+        if xml3d_texture.Image is None:
+            return
+        textures = self.exportTextured(textureMipmaps=True)
+        self.assertTrue(textures)
+        referenced = set()
+        for texture in textures:
+            urls = [texture.getElementsByTagName("img")[0].getAttribute("src")]
+            urls.extend(texture.getAttribute("mipmaps").split())
+            sizes = [xml3d_texture.Image.open(os.path.join(self.directory, url)).size for url in urls]
+            self.assertEqual(sizes, [(128, 64), (64, 32), (32, 16), (16, 8), (8, 4), (4, 2), (2, 1), (1, 1)])
+            referenced.update([os.path.basename(url) for url in urls])
+        self.assertEqual(sorted(referenced), sorted(self.textureFiles()))
+
+
+if __name__ == "__main__":
+    unittest.main()